@@ -0,0 +1,142 @@
+#!/usr/local/bin/python
+
+'''
+			Benchmark of the flat file writer of sam2Flat.py on a synthetic bam file
+
+UTILITY
+   This program generates a random reference genome and a sorted and indexed bam file with random reads in a temporary folder.
+   Then it writes the flat file of sam2Flat.py with the old writer, that formats and writes every base separately,
+   and with the batched writer that builds all rows of one read at once, and reports the rows per second of both.
+
+INPUT ARGUMENTS
+
+    1. number of reads          : the number of reads of the synthetic bam file
+
+DEPENDENCIES
+
+    The program depends on pysam and on sam2Flat.py that has to be in the same folder.
+
+RUNNING
+
+	An execution example is as follows:
+
+    python benchmarkSam2Flat.py numReads=100000
+
+'''
+
+import sys
+import os
+import random
+import shutil
+import tempfile
+import time
+import pysam
+import sam2Flat
+
+
+#prints information about program's execution
+def printUsage():
+    print('To run this program please type the following:')
+    print('\tpython benchmarkSam2Flat.py numReads=N\n')
+    print('Where:\n')
+    print('\tN is the number of reads of the synthetic bam file.\n')
+    print('Execution example:\n')
+    print('\tpython benchmarkSam2Flat.py numReads=100000\n')
+
+#this is the writer of sam2Flat.py before the batched writer; every base is formatted and written separately
+class RowByRowTextWriter(object):
+
+    def __init__(self,OutFile):
+        self.OutFile=OutFile
+
+    def write(self,text):
+        self.OutFile.write(text)
+
+    def addRead(self,read,rows):
+        QNAME=read.query_name
+        RNAME=read.reference_name
+        MAPQ=read.mapping_quality
+        for readPos,refPos,eachFlag,refBase,base,variant in rows:
+            if readPos<0:
+                self.OutFile.write('%s\t%s\t%d\t-\t%d\t%s\t%s\t-\tNO\n'%(QNAME,RNAME,MAPQ,refPos,eachFlag,refBase))
+            elif refPos<0:
+                self.OutFile.write('%s\t%s\t%d\t%d\t-\t%s\t-\t%s\tNO\n'%(QNAME,RNAME,MAPQ,readPos,eachFlag,base))
+            elif variant:
+                self.OutFile.write('%s\t%s\t%d\t%d\t%d\t%s\t%s\t%s\tYES\n'%(QNAME,RNAME,MAPQ,readPos,refPos,eachFlag,refBase,base))
+            else:
+                self.OutFile.write('%s\t%s\t%d\t%d\t%d\t%s\t%s\t%s\tNO\n'%(QNAME,RNAME,MAPQ,readPos,refPos,eachFlag,refBase,base))
+        self.OutFile.write('\n')
+
+    def close(self):
+        self.OutFile.close()
+
+#write a random reference genome and a sorted and indexed bam file with numReads random reads of 100 bp
+def generateSyntheticData(workDir,numReads):
+    random.seed(1)
+    contigLen=1000000
+    refSeq=''.join([random.choice('ACGT') for idx in range(contigLen)])
+    refGenome=os.path.join(workDir,'synthetic.fa')
+    OutFile=open(refGenome,'w')
+    OutFile.write('>chr1\n')
+    for idx in range(0,contigLen,60):
+        OutFile.write(refSeq[idx:idx+60]+'\n')
+    OutFile.close()
+    pysam.faidx(refGenome)
+    cigars=[[(0,100)],[(4,10),(0,90)],[(0,50),(1,2),(0,48)],[(0,50),(2,3),(0,50)]]
+    header={'HD':{'VN':'1.6','SO':'coordinate'},'SQ':[{'SN':'chr1','LN':contigLen}]}
+    unsortedBam=os.path.join(workDir,'unsorted.bam')
+    OutBam=pysam.AlignmentFile(unsortedBam,'wb',header=header)
+    for idx in range(numReads):
+        read=pysam.AlignedSegment()
+        read.query_name='read%d'%idx
+        read.reference_id=0
+        read.reference_start=random.randint(0,contigLen-200)
+        read.mapping_quality=60
+        read.cigartuples=random.choice(cigars)
+        queryLen=sum([length for op,length in read.cigartuples if op in (0,1,4)])
+        #the read is the reference with 1% of random bases
+        read.query_sequence=''.join([random.choice('ACGT') if random.random()<0.01 else base
+                                     for base in refSeq[read.reference_start:read.reference_start+queryLen]])
+        OutBam.write(read)
+    OutBam.close()
+    bamFile=os.path.join(workDir,'synthetic.bam')
+    pysam.sort('-o',bamFile,unsortedBam)
+    pysam.index(bamFile)
+    return bamFile,refGenome
+
+#write the flat file of the bam file with the given writer and return the number of rows and the seconds it took
+def timeWriter(bamFile,refGenome,flatWriter):
+    myFasta=pysam.FastaFile(refGenome)
+    refCache=sam2Flat.ReferenceCache(myFasta)
+    myBam=pysam.AlignmentFile(bamFile,'rb')
+    numRows=0
+    startTime=time.time()
+    for read in myBam.fetch(until_eof=True):
+        rows,countH,countP=sam2Flat.expandRead(read,refCache)
+        flatWriter.addRead(read,rows)
+        numRows=numRows+len(rows)
+    flatWriter.close()
+    elapsed=time.time()-startTime
+    myBam.close()
+    myFasta.close()
+    return numRows,elapsed
+
+#main function of the program
+def myMain():
+    if len(sys.argv)!=2 or not sys.argv[1].startswith('numReads='):
+        printUsage()
+    else:
+        numReads=int(sys.argv[1].split('numReads=')[1])
+        workDir=tempfile.mkdtemp(prefix='benchmarkSam2Flat_')
+        bamFile,refGenome=generateSyntheticData(workDir,numReads)
+        numRows,elapsed=timeWriter(bamFile,refGenome,RowByRowTextWriter(open(os.path.join(workDir,'before_flat.txt'),'w')))
+        print('Row by row writer:\t%d rows in %.2f sec\t%.0f rows/sec'%(numRows,elapsed,numRows/elapsed))
+        numRows,elapsed=timeWriter(bamFile,refGenome,sam2Flat.FlatTextWriter(sam2Flat.openTextOutput(os.path.join(workDir,'after_flat.txt'))))
+        print('Batched writer:   \t%d rows in %.2f sec\t%.0f rows/sec'%(numRows,elapsed,numRows/elapsed))
+        numRows,elapsed=timeWriter(bamFile,refGenome,sam2Flat.FlatTextWriter(sam2Flat.openTextOutput(os.path.join(workDir,'after_flat.txt.gz'),True)))
+        print('Batched bgzip:    \t%d rows in %.2f sec\t%.0f rows/sec'%(numRows,elapsed,numRows/elapsed))
+        shutil.rmtree(workDir)
+
+#this is where we start
+if __name__=='__main__':
+    myMain()
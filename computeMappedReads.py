@@ -36,14 +36,74 @@ END COPYRIGHT NOTICE
 UTILITY
   This program reads a txt file with contig names or chromosome names or regions (e.g, chrom:start-end) and a bam file and reports the number of reads
   mapped to each of the contigs or chromosomes.
+  With a sample sheet of many bam files instead of one bam file, it writes one matrix of counts with the records as rows and the
+  samples as columns.
 
 
 INPUT ARGUMENTS
     
     1. bam file                   : your bam file of interest
 
+       or sample sheet            : sampleSheet=samples.txt with one sample per line, the sample name and the bam file separated
+                                    by TAB, or only the bam file (the sample name is then the file name without .bam)
+
     2. contig file                : a txt file with one record per line. It has either the contig name or the chromosome name
 
+    Optional arguments (given after the mandatory ones in the format name=value)
+
+    flagstat=yes                  : add a flagstat-style breakdown of the reads of every record, counted in the same pass:
+                                    SECONDARY, SUPPLEMENTARY, DUPLICATES, UNMAPPED, PROPERLY_PAIRED, MATE_UNMAPPED (paired
+                                    and mapped reads with the mate unmapped) and the number of reads in the MAPQ bins
+                                    0, 1-9, 10-19, 20-29, 30-59 and 60 or more
+
+    indexStats=yes                : answer the records that are whole contigs (contig, or contig:1-length) from the statistics
+                                    of the bam index (as samtools idxstats, mapped plus unmapped reads placed on the contig)
+                                    without reading them; the index does not know the secondary alignments, so READS_F_256
+                                    is NA for these rows. The other records, and all records with flagstat=yes, are counted
+                                    from their reads. The column MODE gives INDEX or FETCH for every row
+
+    threads=1                     : number of worker processes; the records are sorted by genomic position and split in
+                                    chunks, every worker opens the bam file once and counts the chunks it gets, and the
+                                    rows are printed in the order of the contig file
+
+    sweep=yes                     : for many dense or overlapping regions (e.g. tiled probes); the regions are sorted and
+                                    the regions closer than 10 kb are counted with one pass over their reads, where every
+                                    read is decoded once and counted for all the regions it overlaps. The counts are the
+                                    same as without sweep; with indexStats the MODE of these rows is SWEEP
+
+    outFile=prefix                : with sampleSheet, the prefix of the matrix files (default: the sample sheet without its
+                                    extension and with _matrix)
+
+    matrixReads=ALL_READS         : with sampleSheet, the count of the matrix, ALL_READS or READS_F_256
+
+    cache=yes                     : keep the counts in the SQLite file bamFile.counts.sqlite next to every bam file, and answer
+                                    the records found there without reading the bam file (MODE CACHE with indexStats). The
+                                    key is the path, size and modification time of the bam file, the modification time of
+                                    its index, the record and the counters, so the counts of a changed bam file are not used
+                                    and are deleted. The hits and misses of the run and of all runs are printed at the end
+
+    cacheSize=1000000             : with cache, the number of records kept in the cache of a bam file; the least recently used
+                                    ones are deleted beyond it
+
+    depth=yes                     : add the columns MEAN_DEPTH, MEDIAN_DEPTH, FRAC_20X and FRAC_100X (fraction of the bases
+                                    with depth at least 20 and 100) of every record, from a numpy array of the depth of
+                                    every base built in the same pass over the reads. Only the aligned bases count and the
+                                    reads skipped by samtools depth (unmapped, secondary, QC fail, duplicate) are left out.
+                                    The array has one number per base, so it is meant for regions more than whole contigs;
+                                    these records are always counted from their reads, not from the index or the cache
+
+
+OUTPUT
+
+    One row per record with the number of all reads (as samtools view -c) and of the reads that are not secondary
+    alignments (as samtools view -c -F 256). The reads of every record are fetched once through the index of the bam
+    file and both numbers are counted from the FLAG of the reads.
+
+    With sampleSheet the counts of all samples are written as one matrix with one row per record, in the order of the contig
+    file, and one column per sample, in the order of the sample sheet: prefix.tsv (with the header CONTIG_NAME and the sample
+    names), prefix.npy (the matrix of numpy) and prefix.parquet (the column CONTIG_NAME and one column per sample). The tasks
+    (one bam file and one chunk of records) are counted by a pool of threads workers, and only one matrix is kept in memory.
+
                             
 DEPENDENCIES
     
@@ -61,12 +121,28 @@ DEPENDENCIES
 
     If you work on a cluster make sure that you load the corresponding module using command: module load pysam
 
+    The sampleSheet mode and depth=yes need numpy, and pyarrow is needed for the parquet file of the matrix
+
 
 RUNNING
 	
 	An execution example is as follows:
 
-    python computeMappedReads.py 
+    python computeMappedReads.py bamFile=sample.bam contigFile=contigs.txt
+
+    python computeMappedReads.py bamFile=sample.bam contigFile=contigs.txt flagstat=yes
+
+    python computeMappedReads.py bamFile=sample.bam contigFile=contigs.txt indexStats=yes
+
+    python computeMappedReads.py bamFile=sample.bam contigFile=targets.txt threads=16
+
+    python computeMappedReads.py bamFile=sample.bam contigFile=tiles.txt sweep=yes threads=4
+
+    python computeMappedReads.py sampleSheet=cohort.txt contigFile=targets.txt threads=16 outFile=cohort_counts
+
+    python computeMappedReads.py bamFile=sample.bam contigFile=targets.txt cache=yes
+
+    python computeMappedReads.py bamFile=sample.bam contigFile=targets.txt depth=yes threads=4
 
     To obtain the toy data we used for testing please contact Dimitrios
 
@@ -78,30 +154,778 @@ import sys
 import os
 import re
 from collections import defaultdict
+from collections import OrderedDict
 from itertools import groupby
 import datetime
 import time
-from itertools import izip
+import multiprocessing
+import heapq
+import sqlite3
 import pysam
+#numpy and pyarrow are needed only for the matrix of the sampleSheet mode and the depth arrays of depth=yes
+try:
+    import numpy as np
+except ImportError:
+    np=None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa=None
+    pq=None
+
+#optional arguments given after the mandatory ones in the format name=value
+OPTIONAL_ARGS=['flagstat','indexStats','threads','sweep','outFile','matrixReads','cache','cacheSize','depth']
+
+#with cache the counts are kept in the SQLite file with this suffix next to the bam file, at most this many records
+CACHE_SUFFIX='.counts.sqlite'
+CACHE_SIZE=1000000
+#the new and used rows of the cache are written every this many rows, so they are not all kept in memory
+CACHE_BATCH=10000
+
+#with sampleSheet every worker keeps at most this many bam files open
+MATRIX_HANDLES=16
+
+#with threads the records are given to the workers in chunks of at most this many records
+COUNT_CHUNK=1000
+
+#the MAPQ bins of flagstat=yes start at these values; the last bin has all the larger ones
+MAPQ_BINS=[0,1,10,20,30,60]
+
+#the bin of every MAPQ value, so every read needs only one look up
+MAPQ_BIN=[sum([1 for eachStart in MAPQ_BINS if MAPQ>=eachStart])-1 for MAPQ in range(256)]
+
+#all reads, not secondary reads, the six flag counts and the MAPQ bins of flagstat=yes
+FLAGSTAT_COUNTERS=8+len(MAPQ_BINS)
+
+#with sweep the regions closer than this in bp are counted with one fetch of the bam file
+SWEEP_GAP=10000
+
+#with depth the fraction of the bases with at least these depths is given; the reads with these flags (unmapped,
+#secondary, QC fail, duplicate) are not counted in the depth, as in samtools depth
+DEPTH_THRESHOLDS=[20,100]
+DEPTH_SKIP_FLAGS=0x704
+
+#the aligned blocks of the reads are added to the depth array in batches of this many blocks
+DEPTH_BATCH=1000000
 
 
 #prints information about program's execution
 def printUsage():
     print('To run this program please type the following:')
     print('\tpython computeMappedReads.py bamFile=XXXX contigFile=YYYY\n')
+    print('\tpython computeMappedReads.py sampleSheet=ZZZZ contigFile=YYYY\n')
     print('Where:\n') 
     print('\nbamFile is a BAM file sorted and indexed\n')
+    print('\nsampleSheet is a txt file with the sample name and the bam file (or only the bam file) of one sample per line; the counts are written as a matrix\n')
     print('\ncontigFile is a txt file with contig names, or chromosome name or region in the format e.g., 1:100-2000\n')
     print('Please give the arguments in the indicated order similar to the provided example!\n')
+    print('Optional arguments are given after them in the format name=value:\n')
+    print('\tflagstat=yes adds the number of secondary, supplementary, duplicate, unmapped, properly paired and mate unmapped reads and the MAPQ bins\n')
+    print('\tindexStats=yes counts the whole contigs from the index of the bam file; READS_F_256 is NA and the column MODE tells INDEX or FETCH\n')
+    print('\tthreads=N counts the records with N worker processes; the rows keep the order of the contig file\n')
+    print('\tsweep=yes counts close or overlapping regions with one pass over their reads\n')
+    print('\tcache=yes keeps the counts in bamFile.counts.sqlite and reuses them while the bam file is not changed; cacheSize=N records at most\n')
+    print('\tdepth=yes adds the mean and median depth and the fraction of the bases with depth >=20 and >=100 of every record\n')
+    print('\toutFile=prefix and matrixReads=ALL_READS|READS_F_256 give the files and the count of the matrix of sampleSheet\n')
+
+#check the optional arguments and return them in a dictionary
+def parseOptionalArgs(argList):
+    options={}
+    for eachArg in argList:
+        tmp=eachArg.split('=',1)
+        if len(tmp)!=2 or tmp[0] not in OPTIONAL_ARGS:
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: parseOptionalArgs. The argument %s is not recognised!\n'%(st,eachArg))
+            print('************************************************************************************************************************************\n')
+            printUsage()
+            sys.exit()
+        options[tmp[0]]=tmp[1]
+    return options
+
+#the header of the flagstat-style columns, with the MAPQ bins as MAPQ_start_end
+def flagstatHeader():
+    header='\tSECONDARY\tSUPPLEMENTARY\tDUPLICATES\tUNMAPPED\tPROPERLY_PAIRED\tMATE_UNMAPPED'
+    for idx in range(len(MAPQ_BINS)):
+        if idx==len(MAPQ_BINS)-1:
+            header=header+'\tMAPQ_%d_PLUS'%MAPQ_BINS[idx]
+        elif MAPQ_BINS[idx+1]-1==MAPQ_BINS[idx]:
+            header=header+'\tMAPQ_%d'%MAPQ_BINS[idx]
+        else:
+            header=header+'\tMAPQ_%d_%d'%(MAPQ_BINS[idx],MAPQ_BINS[idx+1]-1)
+    return header
+
+#split one record of the contig file into contig, start and end (0-based, end excluded) as samtools reads it:
+#a contig of the bam file, contig:start-end or contig:start (up to the end of the contig) with 1-based positions
+#it raises ValueError if the record is not a contig or region of the bam file
+def parseRecord(myBam,contigName):
+    if contigName in myBam.references:
+        return contigName,0,myBam.get_reference_length(contigName)
+    tmp=contigName.rsplit(':',1)
+    if len(tmp)!=2 or tmp[0] not in myBam.references:
+        raise ValueError(contigName)
+    chrom=tmp[0]
+    positions=tmp[1].replace(',','').split('-')
+    startPos=int(positions[0])-1
+    endPos=myBam.get_reference_length(chrom)
+    if len(positions)>1 and positions[1]!='':
+        endPos=int(positions[1])
+    if startPos<0 or endPos<=startPos:
+        raise ValueError(contigName)
+    return chrom,startPos,endPos
+
+#check that the bam file has an index, we need it to fetch the reads of the records
+def checkBamIndex(myBam,bamFile,functionName):
+    if not myBam.has_index():
+        ts = time.time()
+        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        print('[%s] ERROR from %s: The bam file %s is not indexed!\n'%(st,functionName,bamFile))
+        print('************************************************************************************************************************************\n')
+        sys.exit()
+
+#depth of every base of a region, built from the aligned blocks of the reads (no deletions or skipped bases) as a
+#difference array: every block adds 1 at its start and -1 at its end, and the depth is the cumulative sum, so there is no
+#loop over the bases; the reads that samtools depth skips (unmapped, secondary, QC fail, duplicate) are not counted
+#the ends of the blocks are kept in lists and added in place to the array (int32) with numpy every DEPTH_BATCH blocks
+class DepthArray(object):
+
+    def __init__(self,startPos,endPos):
+        self.startPos=startPos
+        self.endPos=endPos
+        self.depthChanges=np.zeros(endPos-startPos+1,dtype=np.int32)
+        self.blockStarts=[]
+        self.blockEnds=[]
+        self.depth=None
+
+    #add the aligned blocks of a read, clipped to the region
+    def addRead(self,read):
+        if read.flag&DEPTH_SKIP_FLAGS:
+            return
+        for blockStart,blockEnd in read.get_blocks():
+            if blockEnd>self.startPos and blockStart<self.endPos:
+                self.blockStarts.append(max(blockStart,self.startPos)-self.startPos)
+                self.blockEnds.append(min(blockEnd,self.endPos)-self.startPos)
+        if len(self.blockStarts)>=DEPTH_BATCH:
+            self.flush()
+
+    def flush(self):
+        np.add.at(self.depthChanges,np.array(self.blockStarts,dtype=np.int64),1)
+        np.add.at(self.depthChanges,np.array(self.blockEnds,dtype=np.int64),-1)
+        self.blockStarts=[]
+        self.blockEnds=[]
 
+    #mean depth, median depth and the fraction of the bases with depth at least every one of DEPTH_THRESHOLDS of the
+    #bases from startPos to endPos (by default the whole region)
+    def summary(self,startPos=None,endPos=None):
+        if self.depth is None:
+            self.flush()
+            self.depth=np.cumsum(self.depthChanges[:-1],dtype=np.int32)
+        if startPos is None:
+            startPos=self.startPos
+            endPos=self.endPos
+        depth=self.depth[startPos-self.startPos:endPos-self.startPos]
+        return [float(depth.mean()),float(np.median(depth))]+[float((depth>=eachThreshold).mean()) for eachThreshold in DEPTH_THRESHOLDS]
+
+#the header of the depth columns of depth=yes
+def depthHeader():
+    return '\tMEAN_DEPTH\tMEDIAN_DEPTH'+''.join(['\tFRAC_%dX'%eachThreshold for eachThreshold in DEPTH_THRESHOLDS])
+
+#fetch the reads of one record (contig or region) once and count all reads and the reads without FLAG 256 (secondary),
+#as samtools view -c and samtools view -c -F 256 did in the first version
+#with flagstat it also returns the list of the flagstat-style counts in the order of flagstatHeader, otherwise None
+#with depth it also returns the depth summary of DepthArray from the same reads, otherwise None
+def countReads(myBam,contigName,flagstat=False,depth=False):
+    chrom,startPos,endPos=parseRecord(myBam,contigName)
+    countAll=0
+    countPrimary=0
+    depthArray=None
+    if depth:
+        depthArray=DepthArray(startPos,endPos)
+    if not flagstat:
+        for read in myBam.fetch(chrom,startPos,endPos):
+            countAll=countAll+1
+            if not read.flag&0x100:
+                countPrimary=countPrimary+1
+            if depthArray is not None:
+                depthArray.addRead(read)
+        breakdown=None
+    else:
+        counts=[0]*FLAGSTAT_COUNTERS
+        for read in myBam.fetch(chrom,startPos,endPos):
+            for eachCounter in readCounters(read.flag,read.mapping_quality,True):
+                counts[eachCounter]+=1
+            if depthArray is not None:
+                depthArray.addRead(read)
+        countAll,countPrimary,breakdown=counts[0],counts[1],counts[2:]
+    depthSummary=None
+    if depthArray is not None:
+        depthSummary=depthArray.summary()
+    return countAll,countPrimary,breakdown,depthSummary
+
+#the counters a read adds to: 0 all reads, 1 not secondary and with flagstat the flagstat-style counts from 2 on, in the
+#order of flagstatHeader: secondary, supplementary, duplicates, unmapped, properly paired, mate unmapped and the MAPQ bin
+def readCounters(FLAG,MAPQ,flagstat=False):
+    counters=[0]
+    if not FLAG&0x100:
+        counters.append(1)
+    if not flagstat:
+        return counters
+    if FLAG&0x100:
+        counters.append(2)
+    if FLAG&0x800:
+        counters.append(3)
+    if FLAG&0x400:
+        counters.append(4)
+    if FLAG&0x4:
+        counters.append(5)
+    elif FLAG&0x1:
+        if FLAG&0x2:
+            counters.append(6)
+        if FLAG&0x8:
+            counters.append(7)
+    counters.append(8+MAPQ_BIN[MAPQ])
+    return counters
+
+#the position after the last base of a read as the index of the bam file sees it; unmapped reads placed on a contig, and
+#reads without aligned bases, cover one base
+def readEnd(read):
+    POS=read.reference_start
+    END=read.reference_end
+    if read.flag&0x4 or END is None or END<=POS:
+        END=POS+1
+    return END
+
+#remove from readEnds the reads that end at or before position and add them to endedCounts
+def popEndedReads(readEnds,endedCounts,position):
+    while readEnds and readEnds[0][0]<=position:
+        for eachCounter in heapq.heappop(readEnds)[1]:
+            endedCounts[eachCounter]+=1
+
+#count the regions of one cluster, given as (tid, start, end, position in the contig file) and sorted by start, with
+#one fetch of the reads of the cluster
+#a read overlaps a region if it starts before its end and ends after its start, so the reads of a region are the reads that
+#start before its end minus the reads that end at or before its start; both numbers are taken while the sorted reads are
+#streamed, and only the reads that still cover the position are kept in a heap by their end
+#with depth one DepthArray of the whole cluster is built from the same reads and summarised for every region
+#it returns (position in the contig file, counts, depth summary or None) with the counts in the order of readCounters
+def sweepCluster(myBam,cluster,flagstat=False,depth=False):
+    numCounters=2
+    if flagstat:
+        numCounters=FLAGSTAT_COUNTERS
+    byEnd=sorted(cluster,key=lambda eachRegion:eachRegion[2])
+    seenCounts=[0]*numCounters
+    endedCounts=[0]*numCounters
+    readsBeforeEnd={}
+    readsEndedBeforeStart={}
+    readEnds=[]
+    nextStart=0
+    nextEnd=0
+    chrom=myBam.references[cluster[0][0]]
+    clusterEnd=max([eachRegion[2] for eachRegion in cluster])
+    depthArray=None
+    if depth:
+        depthArray=DepthArray(cluster[0][1],clusterEnd)
+    for read in myBam.fetch(chrom,cluster[0][1],clusterEnd):
+        POS=read.reference_start
+        if depthArray is not None:
+            depthArray.addRead(read)
+        #the regions that start at or before this read have all the reads that end before their start
+        while nextStart<len(cluster) and cluster[nextStart][1]<=POS:
+            popEndedReads(readEnds,endedCounts,cluster[nextStart][1])
+            readsEndedBeforeStart[cluster[nextStart][3]]=list(endedCounts)
+            nextStart=nextStart+1
+        #the regions that end at or before this read have all the reads that start before their end
+        while nextEnd<len(byEnd) and byEnd[nextEnd][2]<=POS:
+            readsBeforeEnd[byEnd[nextEnd][3]]=list(seenCounts)
+            nextEnd=nextEnd+1
+        #the regions still to start begin after this read, so the reads that end here are ended for all of them
+        popEndedReads(readEnds,endedCounts,POS)
+        counters=readCounters(read.flag,read.mapping_quality,flagstat)
+        for eachCounter in counters:
+            seenCounts[eachCounter]+=1
+        heapq.heappush(readEnds,(readEnd(read),counters))
+    for eachRegion in cluster[nextStart:]:
+        popEndedReads(readEnds,endedCounts,eachRegion[1])
+        readsEndedBeforeStart[eachRegion[3]]=list(endedCounts)
+    for eachRegion in byEnd[nextEnd:]:
+        readsBeforeEnd[eachRegion[3]]=list(seenCounts)
+    results=[]
+    for eachRegion in cluster:
+        idx=eachRegion[3]
+        depthSummary=None
+        if depthArray is not None:
+            depthSummary=depthArray.summary(eachRegion[1],eachRegion[2])
+        results.append((idx,[readsBeforeEnd[idx][k]-readsEndedBeforeStart[idx][k] for k in range(numCounters)],depthSummary))
+    return results
+
+#count many records with one pass over the reads of every cluster of close or overlapping regions instead of one fetch
+#per record; the whole contigs are answered from indexCounts as in countRecord
+#it returns (mode, results) for every record in the order of records, with the mode INDEX or SWEEP
+def sweepRecords(myBam,records,flagstat=False,indexCounts=None,depth=False):
+    output=[None]*len(records)
+    regions=[]
+    for idx in range(len(records)):
+        chrom,startPos,endPos=parseRecord(myBam,records[idx])
+        if indexCounts is not None and not flagstat and chrom in indexCounts and startPos==0 and endPos==myBam.get_reference_length(chrom):
+            output[idx]=('INDEX',(indexCounts[chrom],None,None,None))
+        else:
+            regions.append((myBam.get_tid(chrom),startPos,endPos,idx))
+    regions.sort()
+    #the regions closer than SWEEP_GAP are read with the same fetch
+    clusters=[]
+    for eachRegion in regions:
+        if clusters and clusters[-1][0][0]==eachRegion[0] and eachRegion[1]<clusterEnd+SWEEP_GAP:
+            clusters[-1].append(eachRegion)
+            clusterEnd=max(clusterEnd,eachRegion[2])
+        else:
+            clusters.append([eachRegion])
+            clusterEnd=eachRegion[2]
+    for eachCluster in clusters:
+        for idx,counts,depthSummary in sweepCluster(myBam,eachCluster,flagstat,depth):
+            breakdown=None
+            if flagstat:
+                breakdown=counts[2:]
+            output[idx]=('SWEEP',(counts[0],counts[1],breakdown,depthSummary))
+    return output
+
+#the number of reads of every contig from the statistics of the bam index, mapped and unmapped reads placed on the contig
+#as samtools view -c counts them; it returns None if the index has no statistics (e.g. for cram files)
+def readIndexCounts(myBam):
+    try:
+        indexStats=myBam.get_index_statistics()
+    except (ValueError,AttributeError):
+        return None
+    indexCounts={}
+    for eachContig in indexStats:
+        indexCounts[eachContig.contig]=eachContig.total
+    return indexCounts
+
+#count one record; a whole contig is answered from indexCounts if they are given and the flagstat breakdown is not needed,
+#the other records are counted by fetching their reads
+#it returns the mode used, INDEX or FETCH, and the results in the order of countReads (the secondary reads are None for INDEX)
+def countRecord(myBam,contigName,flagstat=False,indexCounts=None,depth=False):
+    results=indexRecord(myBam,contigName,flagstat,indexCounts)
+    if results is not None:
+        return 'INDEX',results
+    return 'FETCH',countReads(myBam,contigName,flagstat,depth)
+
+#the results of a record that is a whole contig from indexCounts, or None if the record has to be counted from its reads
+def indexRecord(myBam,contigName,flagstat=False,indexCounts=None):
+    if indexCounts is None or flagstat:
+        return None
+    chrom,startPos,endPos=parseRecord(myBam,contigName)
+    if chrom in indexCounts and startPos==0 and endPos==myBam.get_reference_length(chrom):
+        return (indexCounts[chrom],None,None,None)
+    return None
+
+#the index file of a bam file (.bam.bai, .bai or .bam.csi), or None if it is not found
+def findIndexFile(bamFile):
+    for eachIndex in [bamFile+'.bai',os.path.splitext(bamFile)[0]+'.bai',bamFile+'.csi']:
+        if os.path.exists(eachIndex):
+            return eachIndex
+    return None
+
+#persistent cache of the counts of one bam file in the SQLite file bamFile.counts.sqlite next to it
+#the key is the bam file (absolute path, size, modification time and modification time of its index), the record and the
+#counters: READS for ALL_READS and READS_F_256, FLAGSTAT for them and the breakdown of flagstat=yes
+#the rows of other versions of the bam file are deleted when the cache is opened, so a changed bam file is counted again,
+#and beyond maxEntries rows the least recently used ones are deleted when the cache is closed
+#the hits and misses of the run are kept, and added to the totals of the cache file when it is closed
+class CountCache(object):
+
+    def __init__(self,bamFile,maxEntries=CACHE_SIZE):
+        bamStat=os.stat(bamFile)
+        indexFile=findIndexFile(bamFile)
+        indexTime=0.0
+        if indexFile is not None:
+            indexTime=os.stat(indexFile).st_mtime
+        self.identity=(os.path.abspath(bamFile),bamStat.st_size,bamStat.st_mtime,indexTime)
+        self.maxEntries=maxEntries
+        self.hits=0
+        self.misses=0
+        self.usedRows=[]
+        self.newRows=[]
+        self.connection=sqlite3.connect(bamFile+CACHE_SUFFIX)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS counts (bam TEXT, size INTEGER, mtime REAL, indexMtime REAL, '
+                                'record TEXT, counters TEXT, value TEXT, lastUsed REAL, '
+                                'PRIMARY KEY (bam, size, mtime, indexMtime, record, counters))')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)')
+        self.connection.execute('DELETE FROM counts WHERE bam=? AND NOT (size=? AND mtime=? AND indexMtime=?)',
+                                self.identity)
+        self.connection.commit()
+
+    #the results of a record in the order of countReads, or None if the record is not in the cache
+    #a FLAGSTAT row answers also a record without flagstat
+    def get(self,contigName,flagstat=False):
+        counters=['FLAGSTAT']
+        if not flagstat:
+            counters=['READS','FLAGSTAT']
+        for eachCounters in counters:
+            row=self.connection.execute('SELECT value FROM counts WHERE bam=? AND size=? AND mtime=? AND indexMtime=? AND record=? AND counters=?',
+                                        self.identity+(contigName,eachCounters)).fetchone()
+            if row is not None:
+                self.hits=self.hits+1
+                self.usedRows.append(self.identity+(contigName,eachCounters))
+                if len(self.usedRows)>=CACHE_BATCH:
+                    self.flush()
+                values=[int(eachValue) for eachValue in row[0].split(',')]
+                breakdown=None
+                if flagstat:
+                    breakdown=values[2:]
+                return (values[0],values[1],breakdown,None)
+        self.misses=self.misses+1
+        return None
+
+    #keep the results of a record counted from its reads; they are written every CACHE_BATCH rows and when the cache is closed
+    def put(self,contigName,results,flagstat=False):
+        countAll,countPrimary,breakdown=results[:3]
+        counters='READS'
+        values=[countAll,countPrimary]
+        if flagstat:
+            counters='FLAGSTAT'
+            values=values+breakdown
+        self.newRows.append(self.identity+(contigName,counters,','.join(['%d'%eachValue for eachValue in values]),time.time()))
+        if len(self.newRows)>=CACHE_BATCH:
+            self.flush()
+
+    #write the new rows and the times of the used rows kept so far
+    def flush(self):
+        now=time.time()
+        self.connection.executemany('INSERT OR REPLACE INTO counts VALUES (?,?,?,?,?,?,?,?)',self.newRows)
+        self.connection.executemany('UPDATE counts SET lastUsed=? WHERE bam=? AND size=? AND mtime=? AND indexMtime=? AND record=? AND counters=?',
+                                    [(now,)+eachRow for eachRow in self.usedRows])
+        self.connection.commit()
+        self.newRows=[]
+        self.usedRows=[]
+
+    #write the rows that are left, delete the least recently used rows beyond maxEntries and print the hits and misses
+    #of this run and of all runs
+    def close(self):
+        self.flush()
+        countRows=self.connection.execute('SELECT COUNT(*) FROM counts').fetchone()[0]
+        if countRows>self.maxEntries:
+            self.connection.execute('DELETE FROM counts WHERE rowid IN (SELECT rowid FROM counts ORDER BY lastUsed LIMIT ?)',
+                                    (countRows-self.maxEntries,))
+            countRows=self.maxEntries
+        for name,value in [('hits',self.hits),('misses',self.misses)]:
+            self.connection.execute('INSERT OR IGNORE INTO stats VALUES (?,0)',(name,))
+            self.connection.execute('UPDATE stats SET value=value+? WHERE name=?',(value,name))
+        totals=dict(self.connection.execute('SELECT name,value FROM stats').fetchall())
+        self.connection.commit()
+        self.connection.close()
+        print('Count cache %s: %d hits, %d misses in this run; %d hits, %d misses in all runs; %d records kept'%(
+              self.identity[0]+CACHE_SUFFIX,self.hits,self.misses,totals['hits'],totals['misses'],countRows))
+
+#open the count cache of a bam file; if the cache file cannot be written next to the bam file the counts are not cached
+def openCountCache(bamFile,maxEntries=CACHE_SIZE):
+    try:
+        return CountCache(bamFile,maxEntries)
+    except sqlite3.OperationalError:
+        print('Warning: the count cache %s cannot be opened; the counts are not cached.'%(bamFile+CACHE_SUFFIX))
+        return None
+
+#format the counts of one record as a row of the output; the counts that are not known are NA
+#with indexStats the mode used for the record is the last column
+def formatCountRow(contigName,results,mode=None):
+    countAll,countPrimary,breakdown,depthSummary=results
+    row='%s\t%d'%(contigName,countAll)
+    if countPrimary is None:
+        row=row+'\tNA'
+    else:
+        row=row+'\t%d'%countPrimary
+    if breakdown is not None:
+        row=row+''.join(['\t%d'%eachCount for eachCount in breakdown])
+    if depthSummary is not None:
+        row=row+'\t%.2f\t%.1f'%(depthSummary[0],depthSummary[1])+''.join(['\t%.4f'%eachFraction for eachFraction in depthSummary[2:]])
+    if mode is not None:
+        row=row+'\t'+mode
+    return row
+
+#every worker opens the bam file once and keeps it for all the chunks of records it counts
+#with sweep the records of a chunk are counted together by sweepRecords
+def initCountWorker(bamFile,flagstat=False,indexStats=False,sweep=False,depth=False):
+    global workerBam,workerFlagstat,workerIndexStats,workerIndexCounts,workerSweep,workerDepth
+    workerBam=pysam.AlignmentFile(bamFile,'rb')
+    workerFlagstat=flagstat
+    workerIndexStats=indexStats
+    workerSweep=sweep
+    workerDepth=depth
+    workerIndexCounts=None
+    if indexStats and not depth:
+        workerIndexCounts=readIndexCounts(workerBam)
+
+#count a list of records of one bam file, with sweepRecords or with countRecord for every record
+#it returns (mode, results) for every record in the order of records
+def countRecords(myBam,records,flagstat=False,indexCounts=None,sweep=False,depth=False):
+    if sweep:
+        return sweepRecords(myBam,records,flagstat,indexCounts,depth)
+    return [countRecord(myBam,contigName,flagstat,indexCounts,depth) for contigName in records]
+
+#count one chunk of (position in the contig file, record) and return (position in the contig file, mode, results)
+def countChunk(chunk):
+    chunkResults=countRecords(workerBam,[contigName for idx,contigName in chunk],workerFlagstat,workerIndexCounts,workerSweep,workerDepth)
+    return [(chunk[chunkIdx][0],)+chunkResults[chunkIdx] for chunkIdx in range(len(chunk))]
+
+#the records of the contig file, the first column of every line
+def readContigFile(contigFile):
+    records=[]
+    fileIN=open(contigFile,'r')
+    for eachLine in fileIN:
+        records.append(eachLine.rstrip('\n').split("\t")[0])
+    fileIN.close()
+    return records
+
+#check the index of the bam file and the records against its contigs, and return the records as (tid, start, end, position
+#in the contig file) sorted by genomic position; a missing index or a wrong record stops the run as in printResults
+def sortRecords(bamFile,records,functionName):
+    myBam=pysam.AlignmentFile(bamFile,'rb')
+    checkBamIndex(myBam,bamFile,functionName)
+    sortKeys=[]
+    for idx in range(len(records)):
+        try:
+            chrom,startPos,endPos=parseRecord(myBam,records[idx])
+        except ValueError:
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from %s: The record %s is not a contig or region of the bam file %s!\n'%(st,functionName,records[idx],bamFile))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
+        sortKeys.append((myBam.get_tid(chrom),startPos,endPos,idx))
+    myBam.close()
+    sortKeys.sort()
+    return sortKeys
+
+#split the sorted records in chunks of positions in the contig file
+#at least four chunks per worker, so a slow chunk does not keep the other workers waiting at the end
+def chunkRecords(sortKeys,threads):
+    chunkSize=max(1,min(COUNT_CHUNK,(len(sortKeys)+4*threads-1)//(4*threads)))
+    chunks=[]
+    for chunkStart in range(0,len(sortKeys),chunkSize):
+        chunks.append([each[3] for each in sortKeys[chunkStart:chunkStart+chunkSize]])
+    return chunks
+
+#the records that are not whole contigs answered by the index are looked up in the cache; the found ones get the mode CACHE
+#and are removed from sortKeys, the others are counted and added to the cache
+def lookUpCache(bamFile,records,sortKeys,cache,flagstat=False,indexStats=False):
+    output={}
+    myBam=pysam.AlignmentFile(bamFile,'rb')
+    indexCounts=None
+    if indexStats:
+        indexCounts=readIndexCounts(myBam)
+    for eachKey in sortKeys:
+        idx=eachKey[3]
+        if indexRecord(myBam,records[idx],flagstat,indexCounts) is None:
+            results=cache.get(records[idx],flagstat)
+            if results is not None:
+                output[idx]=('CACHE',results)
+    myBam.close()
+    return output,[eachKey for eachKey in sortKeys if eachKey[3] not in output]
+
+#count the records with a pool of worker processes and return (mode, results) of the records in their order
+#the records are sorted by genomic position before they are split in chunks, so every worker reads close parts of the
+#bam file; the index and the records are checked before the workers start, so a missing index or a wrong record stops the
+#run as in printResults
+#with threads=1 (only for sweep or cache) all records are one chunk counted in this process
+#with cache only the records that are not in the cache are counted
+#with depth the depth summary of every record is added, and the records are not answered from the index
+def countRecordsParallel(bamFile,records,threads,flagstat=False,indexStats=False,sweep=False,cache=None,depth=False):
+    sortKeys=sortRecords(bamFile,records,'countRecordsParallel')
+    output=[None]*len(records)
+    if cache is not None:
+        cachedResults,sortKeys=lookUpCache(bamFile,records,sortKeys,cache,flagstat,indexStats)
+        for idx in cachedResults:
+            output[idx]=cachedResults[idx]
+    chunks=[]
+    for eachChunk in chunkRecords(sortKeys,threads):
+        chunks.append([(idx,records[idx]) for idx in eachChunk])
+    if threads>1:
+        myPool=multiprocessing.Pool(threads,initCountWorker,(bamFile,flagstat,indexStats,sweep,depth))
+        chunkResults=myPool.imap_unordered(countChunk,chunks)
+    else:
+        initCountWorker(bamFile,flagstat,indexStats,sweep,depth)
+        chunkResults=[countChunk([(each[3],records[each[3]]) for each in sortKeys])]
+    for eachChunk in chunkResults:
+        for idx,mode,results in eachChunk:
+            output[idx]=(mode,results)
+            if cache is not None and mode!='INDEX':
+                cache.put(records[idx],results,flagstat)
+    if threads>1:
+        myPool.close()
+        myPool.join()
+    else:
+        workerBam.close()
+    return output
+
+#the samples of the sample sheet as (sample name, bam file); a line with only the bam file gets the name of the file
+#without .bam as sample name, and empty lines or lines starting with # are skipped
+def readSampleSheet(sampleSheet):
+    samples=[]
+    fileIN=open(sampleSheet,'r')
+    for eachLine in fileIN:
+        line=eachLine.rstrip('\n')
+        if line.strip()=='' or line.startswith('#'):
+            continue
+        tmp=line.split("\t")
+        if len(tmp)>1:
+            samples.append((tmp[0],tmp[1]))
+        else:
+            sampleName=os.path.basename(tmp[0])
+            if sampleName.endswith('.bam'):
+                sampleName=sampleName[:-4]
+            samples.append((sampleName,tmp[0]))
+    fileIN.close()
+    return samples
+
+#every worker of the matrix opens the bam files of its tasks and keeps the last MATRIX_HANDLES of them open
+def initMatrixWorker(bamFiles,indexStats=False,sweep=False,matrixReads='ALL_READS'):
+    global workerBamFiles,workerHandles,workerIndexStats,workerSweep,workerMatrixReads
+    workerBamFiles=bamFiles
+    workerHandles=OrderedDict()
+    workerIndexStats=indexStats
+    workerSweep=sweep
+    workerMatrixReads=matrixReads
+
+#count one task (sample, positions of the records in the contig file, records) of the matrix
+#it returns the sample and the positions of the records with their counts, (mode, results) as countRecords gives them
+def countMatrixTask(task):
+    sampleIdx,recordIdx,records=task
+    if sampleIdx in workerHandles:
+        myBam,indexCounts=workerHandles.pop(sampleIdx)
+    else:
+        myBam=pysam.AlignmentFile(workerBamFiles[sampleIdx],'rb')
+        indexCounts=None
+        if workerIndexStats:
+            indexCounts=readIndexCounts(myBam)
+        if len(workerHandles)>=MATRIX_HANDLES:
+            oldIdx,(oldBam,oldCounts)=workerHandles.popitem(last=False)
+            oldBam.close()
+    workerHandles[sampleIdx]=(myBam,indexCounts)
+    return sampleIdx,recordIdx,countRecords(myBam,records,False,indexCounts,workerSweep)
+
+#write the matrix as TSV with the record and sample names, as npy of numpy and as parquet if pyarrow is installed
+def writeMatrix(matrix,samples,records,outFile):
+    OutFile=open(outFile+'.tsv','w')
+    OutFile.write('CONTIG_NAME\t'+'\t'.join([sampleName for sampleName,bamFile in samples])+'\n')
+    for idx in range(len(records)):
+        OutFile.write(records[idx]+'\t'+'\t'.join(['%d'%eachCount for eachCount in matrix[idx]])+'\n')
+    OutFile.close()
+    np.save(outFile+'.npy',matrix)
+    if pq is None:
+        print('Warning: pyarrow is not installed; the parquet file of the matrix is not written.')
+        return
+    columns=[pa.array(records)]+[pa.array(matrix[:,sampleIdx]) for sampleIdx in range(len(samples))]
+    pq.write_table(pa.table(columns,names=['CONTIG_NAME']+[sampleName for sampleName,bamFile in samples]),outFile+'.parquet')
+
+#count the records of the contig file in all bam files of the sample sheet and write the matrix of the counts
+#the records are checked and sorted by genomic position once, and again only for a bam file with other contigs than the
+#one before; the samples are counted one after the other, every chunk of the sorted records is one task of the pool and the
+#tasks of a sample are done before the ones of the next sample are given, so only the matrix and the tasks of one sample
+#are kept in memory
+#with cache the records found in the cache of a bam file are not counted again for it, and the cache is closed when the
+#sample is done
+def countMatrix(sampleSheet,contigFile,outFile,threads=1,indexStats=False,sweep=False,matrixReads='ALL_READS',cache=False,cacheSize=CACHE_SIZE):
+    if not (os.path.exists(sampleSheet) and os.path.exists(contigFile)):
+        ts = time.time()
+        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        print('[%s] ERROR from countMatrix: One of the input files does not exist!\n'%(st))
+        print('************************************************************************************************************************************\n')
+        sys.exit()
+    samples=readSampleSheet(sampleSheet)
+    records=readContigFile(contigFile)
+    for sampleName,bamFile in samples:
+        if not os.path.exists(bamFile):
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from countMatrix: The bam file %s of sample %s does not exist!\n'%(st,bamFile,sampleName))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
+    matrix=np.zeros((len(records),len(samples)),dtype=np.int64)
+    column=0
+    if matrixReads=='READS_F_256':
+        column=1
+    bamFiles=[bamFile for sampleName,bamFile in samples]
+    if threads>1:
+        myPool=multiprocessing.Pool(threads,initMatrixWorker,(bamFiles,indexStats,sweep,matrixReads))
+    else:
+        initMatrixWorker(bamFiles,indexStats,sweep,matrixReads)
+    sortHeader=None
+    sortKeys=None
+    for sampleIdx in range(len(samples)):
+        sampleName,bamFile=samples[sampleIdx]
+        myBam=pysam.AlignmentFile(bamFile,'rb')
+        checkBamIndex(myBam,bamFile,'countMatrix')
+        bamHeader=(myBam.references,myBam.lengths)
+        myBam.close()
+        if bamHeader!=sortHeader:
+            sortKeys=sortRecords(bamFile,records,'countMatrix')
+            sortHeader=bamHeader
+        bamKeys=sortKeys
+        sampleCache=None
+        if cache:
+            sampleCache=openCountCache(bamFile,cacheSize)
+        if sampleCache is not None:
+            cachedResults,bamKeys=lookUpCache(bamFile,records,bamKeys,sampleCache,False,indexStats)
+            for idx in cachedResults:
+                matrix[idx,sampleIdx]=cachedResults[idx][1][column]
+        tasks=[(sampleIdx,eachChunk,[records[idx] for idx in eachChunk]) for eachChunk in chunkRecords(bamKeys,threads)]
+        if threads>1:
+            taskResults=myPool.imap_unordered(countMatrixTask,tasks)
+        else:
+            taskResults=(countMatrixTask(eachTask) for eachTask in tasks)
+        for sampleIdx,recordIdx,taskCounts in taskResults:
+            matrix[recordIdx,sampleIdx]=[results[column] for mode,results in taskCounts]
+            if sampleCache is not None:
+                for idx,(mode,results) in zip(recordIdx,taskCounts):
+                    if mode!='INDEX':
+                        sampleCache.put(records[idx],results)
+        if sampleCache is not None:
+            sampleCache.close()
+    if threads>1:
+        myPool.close()
+        myPool.join()
+    print('Counted %d records in %d samples'%(len(records),len(samples)))
+    writeMatrix(matrix,samples,records,outFile)
 
 #compute the reads and print it
-def printResults(bamFile,contigFile):
+#the bam file is opened once and the reads of every record are fetched in one pass
+#with indexStats the whole contigs are counted from the index of the bam file
+#with threads>1 or sweep the records are counted by countRecordsParallel and printed when all of them are done
+#with cache the counts are kept in the count cache next to the bam file and the records found there are not counted again
+#with depth the depth summary columns are added from the same pass; the cache and the index are not used for them
+def printResults(bamFile,contigFile,flagstat=False,indexStats=False,threads=1,sweep=False,cache=False,cacheSize=CACHE_SIZE,depth=False):
 
     #print the header of the output
-    print('CONTIG_NAME\tALL_READS\tREADS_F_256\n')
+    header='CONTIG_NAME\tALL_READS\tREADS_F_256'
+    if flagstat:
+        header=header+flagstatHeader()
+    if depth:
+        header=header+depthHeader()
+    if indexStats:
+        header=header+'\tMODE'
+    print(header+'\n')
     #check if the files exist
-    if os.path.exists(bamFile) and os.path.exists(contigFile):
+    countCache=None
+    if cache and not depth and os.path.exists(bamFile):
+        countCache=openCountCache(bamFile,cacheSize)
+    if os.path.exists(bamFile) and os.path.exists(contigFile) and (threads>1 or sweep):
+        records=readContigFile(contigFile)
+        output=countRecordsParallel(bamFile,records,threads,flagstat,indexStats,sweep,countCache,depth)
+        for idx in range(len(records)):
+            mode,results=output[idx]
+            if not indexStats:
+                mode=None
+            print(formatCountRow(records[idx],results,mode)+'\n')
+        if countCache is not None:
+            countCache.close()
+    elif os.path.exists(bamFile) and os.path.exists(contigFile):
+        myBam=pysam.AlignmentFile(bamFile,'rb')
+        checkBamIndex(myBam,bamFile,'printResults')
+        indexCounts=None
+        if indexStats and not depth:
+            indexCounts=readIndexCounts(myBam)
+            if indexCounts is None:
+                print('Warning: the index of %s has no statistics; all records are counted from their reads.'%bamFile)
 
         #read the contigs line by line
         fileIN=open(contigFile,'r')
@@ -114,16 +938,35 @@ def printResults(bamFile,contigFile):
             #print(contigName)
             #make the command
 
+            #check the record before the main work
+            try:
+                parseRecord(myBam,contigName)
+            except ValueError:
+                ts = time.time()
+                st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+                print('[%s] ERROR from printResults: The record %s is not a contig or region of the bam file!\n'%(st,contigName))
+                print('************************************************************************************************************************************\n')
+                sys.exit()
+
             #here is the main work
-            reads_all=pysam.view(bamFile,contigName,'-c')
-            reads_F=pysam.view(bamFile,contigName,'-c','-F','256')
-            r1=reads_all[0]
-            r1=int(r1)
-            r2=reads_F[0]
-            r2=int(r2)
-            print('%s\t%d\t%d\n'%(contigName,r1,r2))
-        #close the file
+            mode='INDEX'
+            results=indexRecord(myBam,contigName,flagstat,indexCounts)
+            if results is None and countCache is not None:
+                mode='CACHE'
+                results=countCache.get(contigName,flagstat)
+            if results is None:
+                mode='FETCH'
+                results=countReads(myBam,contigName,flagstat,depth)
+                if countCache is not None:
+                    countCache.put(contigName,results,flagstat)
+            if not indexStats:
+                mode=None
+            print(formatCountRow(contigName,results,mode)+'\n')
+        #close the files
         fileIN.close()
+        myBam.close()
+        if countCache is not None:
+            countCache.close()
     else:
         #print a message and exit
         ts = time.time()
@@ -135,7 +978,7 @@ def printResults(bamFile,contigFile):
 #main function of the program
 def myMain():
     #check the number of input arguments
-    if len(sys.argv)!=3:
+    if len(sys.argv)<3 or not ((sys.argv[1].startswith('bamFile=') or sys.argv[1].startswith('sampleSheet=')) and sys.argv[2].startswith('contigFile=')):
         print('************************************************************************************************************************************\n')
         print('\t\t\t\t\tYour input arguments are not correct!\n')
         print('\t\t\t\t\t\tCEC Bioinformatics\n')
@@ -149,21 +992,67 @@ def myMain():
         
         #parse the input arguments 
         #here if the user does not write the correct argument name it gets an error and the program stops
-        bamFile =sys.argv[1].split('bamFile=')
-        bamFile =bamFile[1]
+        bamFile='-'
+        sampleSheet='-'
+        if sys.argv[1].startswith('bamFile='):
+            bamFile =sys.argv[1].split('bamFile=')
+            bamFile =bamFile[1]
+        else:
+            sampleSheet=sys.argv[1].split('sampleSheet=')[1]
         
         contigFile =sys.argv[2].split('contigFile=')
         contigFile =contigFile[1]
 
+        #parse the optional arguments
+        options=parseOptionalArgs(sys.argv[3:])
+        flagstat=options.get('flagstat','no')
+        indexStats=options.get('indexStats','no')
+        threads=int(options.get('threads',1))
+        sweep=options.get('sweep','no')
+        outFile=options.get('outFile',os.path.splitext(sampleSheet)[0]+'_matrix')
+        matrixReads=options.get('matrixReads','ALL_READS')
+        cache=options.get('cache','no')
+        cacheSize=int(options.get('cacheSize',CACHE_SIZE))
+        depth=options.get('depth','no')
+        if depth=='yes' and (np is None or sampleSheet!='-'):
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: myMain. depth needs numpy and is available with bamFile, not with sampleSheet!\n'%(st))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
+        if sampleSheet!='-' and (np is None or flagstat=='yes' or matrixReads not in ['ALL_READS','READS_F_256'] or (matrixReads=='READS_F_256' and indexStats=='yes')):
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: myMain. sampleSheet needs numpy and matrixReads ALL_READS or READS_F_256, without flagstat; indexStats gives only ALL_READS!\n'%(st))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
+
         #print the arguments given by user; is good for 'self' debugging
         print('Execution started with the following parameters:\n')
-        print('1. bamFile       :         \t\t\t\t%s' % bamFile)
+        if sampleSheet!='-':
+            print('1. sampleSheet   :         \t\t\t\t%s' % sampleSheet)
+        else:
+            print('1. bamFile       :         \t\t\t\t%s' % bamFile)
         print('2. contigFile    :         \t\t\t\t%s' % contigFile)
+        print('3. flagstat      :         \t\t\t\t%s' % flagstat)
+        print('4. indexStats    :         \t\t\t\t%s' % indexStats)
+        print('5. threads       :         \t\t\t\t%d' % threads)
+        print('6. sweep         :         \t\t\t\t%s' % sweep)
+        if sampleSheet!='-':
+            print('7. outFile       :         \t\t\t\t%s' % outFile)
+            print('8. matrixReads   :         \t\t\t\t%s' % matrixReads)
+        print('9. cache         :         \t\t\t\t%s' % cache)
+        print('10. cacheSize    :         \t\t\t\t%d' % cacheSize)
+        print('11. depth        :         \t\t\t\t%s' % depth)
         
         ts = time.time()
         st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-        print('\n[%s] Function printResults'%(st))
-        printResults(bamFile,contigFile)
+        if sampleSheet!='-':
+            print('\n[%s] Function countMatrix'%(st))
+            countMatrix(sampleSheet,contigFile,outFile,threads,indexStats=='yes',sweep=='yes',matrixReads,cache=='yes',cacheSize)
+        else:
+            print('\n[%s] Function printResults'%(st))
+            printResults(bamFile,contigFile,flagstat=='yes',indexStats=='yes',threads,sweep=='yes',cache=='yes',cacheSize,depth=='yes')
 
         
         print('************************************************************************************************************************************\n')
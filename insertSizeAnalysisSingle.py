@@ -37,13 +37,68 @@ UTILITY
   This program takes as input a bam file and one interval in the format chrom:start-end and computes
   for this interval, the number of reads, the number of paired ones, the number of not paired and 
   the insert size distribution (TLEN field in the sam format). Please see the header of the program's output.
+  The mates are paired while the reads are streamed from the bam file, so the memory does not grow with the size of
+  the interval. Secondary and supplementary alignments are counted in READS but they are not used to pair the reads.
 
 
 INPUT ARGUMENTS
     
     1. bam file              : a bam file from the tumour or plasma of interest
     
-    2. interval              : in the designated format chrom:starPos-endPos
+    2. interval              : in the designated format chrom:starPos-endPos, or only chrom for the whole contig
+
+       or bed file           : bedFile=file.bed analyses all intervals of the bed file in one run and writes one report
+                               with one row per interval, in the order of the bed file, and the same columns as for one interval
+
+    Optional arguments (given after the mandatory ones in the format name=value)
+
+    threads=1                : number of worker processes for the intervals of the bed file; every worker opens the bam
+                               file once and keeps it for all the intervals it analyses
+
+    maxInsertSize=2000       : the insert sizes are counted in a histogram with bins of 1 bp up to this size; the larger
+                               ones are counted in one more bin (maxInsertSize+1)
+
+    rawLengths=yes           : add the columns DIST_PAIRED and DIST_NO_PAIRED with all insert sizes joined by ':',
+                               as in the first version of the program
+
+       or profile            : profile=yes streams the whole bam file once and writes the summary of the insert sizes of the
+                               fragments in windows along the genome (suffix _profile_<window>_<step>.bedGraph). Every fragment
+                               is counted once, by the mate with TLEN>0, in the windows that contain the middle of the fragment.
+                               The contigs are processed in parallel with threads.
+
+    window=1000000           : size in bp of the windows of the profile
+
+    step=1000000             : step in bp between the starts of two windows of the profile; the window must be a multiple of it
+
+    samplePairs=N            : fast approximate mode for region and bedFile. The insert size is estimated from N fragments
+                               (counted by the mate with TLEN>0 that starts in the region); the region is read in blocks of
+                               100 kb in a fixed random order, and every block gives at most its share of the N fragments
+                               that are still needed, so the sample comes from at least 100 blocks (or all the blocks of a
+                               smaller region); the reading stops as soon as N fragments are found.
+                               The report (suffix _sample_report.txt) gives the blocks read, the summary of the sampled insert
+                               sizes and the 95% confidence intervals of the mean and the median.
+
+    sampleFraction=f         : keep only the fraction f of the fragments, chosen by a hash of QNAME so both mates of a pair
+                               get the same decision and every run takes the same sample; it can be combined with samplePairs
+
+    resolveMates=yes         : look up the mates of the not paired reads outside the interval. The mate positions are sorted
+                               and the close ones are fetched together, and the answers are kept for the next intervals of
+                               the bed file. The report gets the columns MATE_FETCHES (fetches of the bam file), MATES_OUTSIDE
+                               (not paired reads with the mate found outside the interval), CORRECTED_PAIRED (PAIRED_READS plus
+                               MATES_OUTSIDE) and CORRECTED_NOT_PAIRED (NOT_PAIRED minus MATES_OUTSIDE).
+
+    groupBy=RG               : count the reads of every read group (RG tag) separately in the same pass, or of every library
+                               with groupBy=LB (LB of the read group in the header). The report gets the column GROUP after END,
+                               with one row per group and one row ALL with all reads; reads without read group are in group NA.
+                               The histogram file has the types group:PAIRED and group:NO_PAIRED.
+
+OUTPUT
+
+    The report (suffix _report.txt) has one row per interval with the counts of the reads and, for the paired reads (TLEN>0)
+    and for the not paired reads with the mate on the same contig, the number of insert sizes, their mean, median,
+    median absolute deviation, 5th and 95th percentile and the most frequent size (NA if there are none).
+    The histogram file (suffix _histogram.txt) has one row per interval, type (PAIRED or NO_PAIRED) and insert size
+    with the number of reads, only for the sizes that are seen.
                               
     
 DEPENDENCIES
@@ -60,18 +115,19 @@ DEPENDENCIES
 
     The program depends on pysam libraries downloaded from http://pysam.readthedocs.io/en/latest/index.html
 
-    The program also depends on samtools, so please make sure that SAMtools is installed and configured properly in your system
-
-    You might need to add samtools in your path so after you intall SAMtools you might need a command like: 
+    The program also depends on numpy for the histograms of the insert sizes
 
-    PATH=$PATH:/your/path/to/Samtools
+    The reads of the interval are fetched with pysam through the index of the bam file, so the bam file has to be
+    sorted and indexed (samtools index); no intermediate sam file is written.
 
 
 RUNNING
 	
 	An execution example is as follows:
 
-    python insertSizeAnalysisSingle.py bamFile=0097_test.chr17.bam regions=chrom:100-10000
+    python insertSizeAnalysisSingle.py bamFile=0097_test.chr17.bam region=chrom:100-10000
+
+    python insertSizeAnalysisSingle.py bamFile=0097_test.chr17.bam bedFile=amplicons.bed threads=4
 
     To obtain the toy data we used for testing please contact Dimitrios
 
@@ -84,174 +140,691 @@ import os
 import pysam
 import re
 from collections import defaultdict
+from collections import OrderedDict
 from itertools import groupby
 import datetime
 import time
+import multiprocessing
+import heapq
+import math
+import random
+import zlib
+import numpy as np
 
 #define minimum mapping quality; in a next implementation this can be adjusted by the user
-quality='10'
+quality=10
+
+#optional arguments given after the mandatory ones in the format name=value
+OPTIONAL_ARGS=['threads','maxInsertSize','rawLengths','window','step','samplePairs','sampleFraction','resolveMates','groupBy']
+
+#with resolveMates the mate positions closer than this in bp are fetched together, and the answers of this many
+#mates are kept in memory for the next regions
+MATE_BATCH_GAP=10000
+MATE_CACHE_SIZE=1000000
+
+#size and step in bp of the windows of the genome-wide profile
+PROFILE_WINDOW=1000000
+PROFILE_STEP=1000000
+
+#the insert sizes are counted in bins of 1 bp up to this size; the larger ones are counted in one more bin
+MAX_INSERT_SIZE=2000
+
+#insert sizes kept in a list before they are added to the histogram with numpy
+HIST_BUFFER=100000
+
+#seconds between two progress messages of the batch mode
+PROGRESS_INTERVAL=10
+
+#header of the report; there is one row per region
+#the summary of the insert sizes is given for the paired reads (TLEN>0) and for the not paired reads with the mate on the same contig
+REPORT_HEADER='#CHROM\tSTART\tEND\tREGION_SIZE\tREADS\tPAIRED_READS\tNOT_PAIRED\tNOT_PAIRED_SAME\tNOT_PAIRED_OTHER'
+SUMMARY_FIELDS=['N','MEAN','MEDIAN','MAD','P5','P95','MODE']
+REPORT_HEADER=REPORT_HEADER+''.join(['\tPAIRED_'+eachField for eachField in SUMMARY_FIELDS])+''.join(['\tNO_PAIRED_'+eachField for eachField in SUMMARY_FIELDS])
+
+#columns of the report with resolveMates=yes
+MATE_HEADER='\tMATE_FETCHES\tMATES_OUTSIDE\tCORRECTED_PAIRED\tCORRECTED_NOT_PAIRED'
+
+#with samplePairs the region is read in blocks of this size in bp, in a random order that is the same in every run
+SAMPLE_BLOCK=100000
+SAMPLE_SEED=17
+#with samplePairs the fragments still needed are shared among at least this many blocks, so one block gives at most its share
+SAMPLE_MIN_BLOCKS=100
+
+#the confidence intervals of the sampling mode are 95% intervals of the normal approximation
+CONFIDENCE_Z=1.96
+
+#header of the report of the sampling mode; there is one row per region
+SAMPLE_HEADER='#CHROM\tSTART\tEND\tBLOCKS_READ\tBLOCKS'+''.join(['\t'+eachField for eachField in SUMMARY_FIELDS])+'\tMEAN_CI_LOW\tMEAN_CI_HIGH\tMEDIAN_CI_LOW\tMEDIAN_CI_HIGH\n'
+
+#header of the genome-wide profile; there is one row per window as in a bedGraph file
+PROFILE_HEADER='#CHROM\tSTART\tEND'+''.join(['\t'+eachField for eachField in SUMMARY_FIELDS])+'\n'
+
+#header of the histogram file; only the bins with reads are written
+HISTOGRAM_HEADER='#CHROM\tSTART\tEND\tTYPE\tINSERT_SIZE\tCOUNT\n'
 
 
 #prints information about program's execution
 def printUsage():
     print('To run this program please type the following:')
     print('\tpython insertSizeAnalysis.py bamFile=file.bam region=chr1:1500-10000\n')
+    print('or, for all intervals of a bed file:\n')
+    print('\tpython insertSizeAnalysis.py bamFile=file.bam bedFile=file.bed threads=N\n')
+    print('or, for windows along the whole genome:\n')
+    print('\tpython insertSizeAnalysis.py bamFile=file.bam profile=yes window=N step=M threads=N\n')
     print('Where:\n') 
     print('\tfile.bam is a bam file. The bam file needs to be indexed with samtools.\n')
     print('\tregion gives the genomic coordinates of the interval of interest in a specific format.\n')
+    print('\tfile.bed gives the intervals of interest; the report has one row per interval in the order of the bed file.\n')
+    print('\tprofile=yes writes the summary of the insert sizes of the fragments in windows of window bp every step bp along the genome.\n')
+    print('\tthreads=N analyses the intervals of the bed file, or the contigs with profile=yes, with N worker processes (default 1).\n')
+    print('\tsamplePairs=N estimates the insert size from N fragments taken from at least %d blocks of the region in a random order and stops as soon as it has them.\n'%SAMPLE_MIN_BLOCKS)
+    print('\tsampleFraction=f estimates the insert size from the fraction f of the fragments, chosen by QNAME so both mates agree.\n')
+    print('\tgroupBy=RG|LB writes one row per read group or library, and one row for all reads, for every region.\n')
+    print('\tresolveMates=yes looks up the mates outside the region of the not paired reads and adds the corrected counts of paired reads.\n')
+    print('\twindow=N and step=N give the size and the step of the windows of the profile (default %d and %d); window must be a multiple of step.\n'%(PROFILE_WINDOW,PROFILE_STEP))
+    print('\tmaxInsertSize=N counts the insert sizes in bins of 1 bp up to N and the larger ones in one bin (default %d).\n'%MAX_INSERT_SIZE)
+    print('\trawLengths=yes adds the columns DIST_PAIRED and DIST_NO_PAIRED with all insert sizes joined by :\n')
     print('Execution example:\n') 
     print('\tpython insertSizeAnalysis.py bamFile=0097_test.bam region=chr11:1500-10000 \n')
+    print('\tpython insertSizeAnalysis.py bamFile=0097_test.bam bedFile=amplicons.bed threads=4 \n')
     print('Please give the arguments in the indicated order similar to the provided example!\n') 
     print('\t\tBy default the program applies MAPQ=10\n') 
 
-#this function takes as input the bamFile, and the region of interest and produces a sam file with all reads spanning the positions
-def generateSamFile(bamFile,samFileName,chrom,startPos,endPos,SAM_FILES):
-#first check if the bam file exists
+#counts the insert sizes in a fixed histogram with bins of 1 bp from 0 to maxSize and one more bin for the larger sizes
+#the sizes are buffered in a list and added with numpy.bincount, so we do not index the numpy array for every read
+#with keepRaw all sizes are also kept in a list, in the order they were added
+class InsertSizeHistogram(object):
+
+    def __init__(self,maxSize=MAX_INSERT_SIZE,keepRaw=False):
+        self.counts=np.zeros(maxSize+2,dtype=np.int64)
+        self.total=0
+        self.totalSquares=0.0
+        self.buffer=[]
+        self.raw=None
+        if keepRaw:
+            self.raw=[]
+
+    def add(self,size):
+        self.buffer.append(size)
+        if len(self.buffer)>=HIST_BUFFER:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            values=np.array(self.buffer,dtype=np.int64)
+            self.total=self.total+int(values.sum())
+            self.totalSquares=self.totalSquares+float(np.dot(values.astype(np.float64),values))
+            values=np.minimum(values,len(self.counts)-1)
+            self.counts=self.counts+np.bincount(values,minlength=len(self.counts))
+            if self.raw is not None:
+                self.raw.extend(self.buffer)
+            self.buffer=[]
+
+    #add the counts of another histogram with the same bins
+    def merge(self,other):
+        self.flush()
+        other.flush()
+        self.counts=self.counts+other.counts
+        self.total=self.total+other.total
+        self.totalSquares=self.totalSquares+other.totalSquares
+        if self.raw is not None and other.raw is not None:
+            self.raw.extend(other.raw)
+
+    #remove the counts of another histogram that was merged in this one before
+    def remove(self,other):
+        self.flush()
+        other.flush()
+        self.counts=self.counts-other.counts
+        self.total=self.total-other.total
+        self.totalSquares=self.totalSquares-other.totalSquares
+
+    def count(self):
+        self.flush()
+        return int(self.counts.sum())
+
+    #the value at fraction q of the sorted sizes, interpolated between the two nearest sizes as numpy.percentile does
+    def percentile(self,q):
+        return weightedPercentile(np.arange(len(self.counts)),self.counts,q)
+
+    #count, mean, median, median absolute deviation, 5th and 95th percentile and the most frequent size
+    #the mean uses the exact sizes; the other statistics see the sizes larger than maxSize as maxSize+1
+    def summary(self):
+        numSizes=self.count()
+        if numSizes==0:
+            return (0,None,None,None,None,None,None)
+        sizes=np.arange(len(self.counts))
+        median=self.percentile(0.5)
+        deviations=np.abs(sizes-median)
+        order=np.argsort(deviations,kind='mergesort')
+        mad=weightedPercentile(deviations[order],self.counts[order],0.5)
+        return (numSizes,float(self.total)/numSizes,median,mad,self.percentile(0.05),self.percentile(0.95),int(np.argmax(self.counts)))
+
+    #confidence intervals of the mean, from the normal approximation, and of the median, from the ranks of the sorted sizes
+    #around the middle; the histogram must have sizes
+    def confidenceIntervals(self):
+        numSizes=self.count()
+        mean=float(self.total)/numSizes
+        variance=max(self.totalSquares/numSizes-mean*mean,0.0)*numSizes/max(numSizes-1,1)
+        halfWidth=CONFIDENCE_Z*math.sqrt(variance/numSizes)
+        lowRank=max(int(math.floor(numSizes/2.0-CONFIDENCE_Z*math.sqrt(numSizes)/2.0)),0)
+        highRank=min(int(math.ceil(numSizes/2.0+CONFIDENCE_Z*math.sqrt(numSizes)/2.0)),numSizes-1)
+        cumCounts=np.cumsum(self.counts)
+        return (mean-halfWidth,mean+halfWidth,int(np.searchsorted(cumCounts,lowRank+1)),int(np.searchsorted(cumCounts,highRank+1)))
+
+#the value at fraction q of the sorted values, where values are sorted and counts[i] is the number of times values[i] is seen
+#as numpy.percentile, the position of q is (n-1)*q and it is interpolated between the two values around it
+def weightedPercentile(values,counts,q):
+    cumCounts=np.cumsum(counts)
+    position=(cumCounts[-1]-1)*q
+    lower=int(np.floor(position))
+    upper=int(np.ceil(position))
+    lowerValue=values[np.searchsorted(cumCounts,lower+1)]
+    upperValue=values[np.searchsorted(cumCounts,upper+1)]
+    return float(lowerValue+(upperValue-lowerValue)*(position-lower))
+
+#open the bam file and check that it has an index, since the reads of the region are fetched through it
+def openBamFile(bamFile):
     if os.path.exists(bamFile):
-        #the bam file exists
-        
-        #write the interval in a bed file
-        tmpBedFile=SAM_FILES+'/'+chrom+'_'+startPos+'_tmp.bed'
-        tmpOut=open(tmpBedFile,'w')
-        tmpOut.write('%s\t%s\t%s'%(chrom,startPos,endPos))
-        tmpOut.close()
-        #prepare the output of my SAM file
-        outSAM=open(samFileName,'w')
-        for eachLine in pysam.view('-q',quality,'-L',tmpBedFile,bamFile):
-          outSAM.write(eachLine)
-        outSAM.close()
+        myBam=pysam.AlignmentFile(bamFile,'rb')
+        if not myBam.has_index():
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: openBamFile. The bam file is not indexed; please index it with samtools index!\n'%(st))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
+        return myBam
     else:
         ts = time.time()
         st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-        print('[%s] ERROR from function: generateSamFile. The bam file does not exist!\n'%(st))
+        print('[%s] ERROR from function: openBamFile. The bam file does not exist!\n'%(st))
         print('************************************************************************************************************************************\n')
         sys.exit()
 
-#this function parses the sam file and computes the number of reads as well as the number of 
-def parseSamFile(samFileName,bamFilePrefix,chrom,startPos,endPos,RESULTS):
-  if os.path.exists(samFileName):
-
-    #another sanity check
-    regionSize=int(endPos)-int(startPos)
-
-    #write the output
-    reportFile=RESULTS+'/'+bamFilePrefix+'_'+chrom+'_'+startPos+'_report.txt'
-    OutReportFile=open(reportFile,'w')
-    OutReportFile.write('#CHROM\tSTART\tEND\tREGION_SIZE\tREADS\tPAIRED_READS\tNOT_PAIRED\tNOT_PAIRED_SAME\tNOT_PAIRED_OTHER\tDIST_PAIRED\tDIST_NO_PAIRED\n')
-
-    InSamFile=open(samFileName,'r')
-    countTotalReads=0
-    countReadPairs=0
-    countNotPaired=0
-    countNotPairedSame=0
-    countNotPairedOther=0
-    qHash=defaultdict(list)
-    pairedLen=[]
-    nonPairedLen=[]
-    for eachLine in InSamFile:
-      countTotalReads=countTotalReads+1
-      #store the reads by QNAME so we can identify the paired reads
-      line = eachLine.rstrip('\n')
-      tmp=line.split("\t")
-      #read the sam fields we neeed
-      QNAME=tmp[0]
-      FLAG=tmp[1]
-      RNAME=tmp[2]
-      POS=tmp[3]
-      MAPQ=tmp[4]
-      CIGAR=tmp[5]
-      RNEXT=tmp[6]
-      PNEXT=tmp[7]
-      TLEN=tmp[8]
-      #store records in the qHash
-      #consider all reads irespective of the mapping quality
-      #in another implemetation this will be adjusted by the user
-      #quality=int(MAPQ)
-      qnameKey=QNAME
-      qHash[qnameKey].append(eachLine)
-    #parse the reads by Qname
-    for key in qHash:
-      pairFound=qHash[key]
-      for idx in pairFound:
-        #find the ones with no mate
-        if len(pairFound)==1:
-        #find the ones with mate
-          tmp=idx.split("\t")
-          QNAME=tmp[0]
-          FLAG=tmp[1]
-          RNAME=tmp[2]
-          POS=tmp[3]
-          MAPQ=tmp[4]
-          CIGAR=tmp[5]
-          RNEXT=tmp[6]
-          PNEXT=tmp[7]
-          TLEN=tmp[8]
-          myLen=abs(int(TLEN))
-          #print(QNAME)
-          countNotPaired=countNotPaired+1
-          if RNEXT=='=':
-            countNotPairedSame=countNotPairedSame+1
-            nonPairedLen.append(myLen)
-          else:
+#counters, histograms of the insert sizes and mates to look up of the reads of one region, or of one read group of it
+class RegionCounts(object):
+
+    def __init__(self,maxInsertSize=MAX_INSERT_SIZE,rawLengths=False):
+        self.countTotalReads=0
+        self.countReadPairs=0
+        self.countNotPaired=0
+        self.countNotPairedSame=0
+        self.countNotPairedOther=0
+        self.pairedLen=InsertSizeHistogram(maxInsertSize,rawLengths)
+        self.nonPairedLen=InsertSizeHistogram(maxInsertSize,rawLengths)
+        #the mates to look up outside the region as (RNEXT, PNEXT, QNAME, the mate is read 1)
+        self.mateLoci=[]
+
+    #add the counts of another read group of the region
+    def merge(self,other):
+        self.countTotalReads=self.countTotalReads+other.countTotalReads
+        self.countReadPairs=self.countReadPairs+other.countReadPairs
+        self.countNotPaired=self.countNotPaired+other.countNotPaired
+        self.countNotPairedSame=self.countNotPairedSame+other.countNotPairedSame
+        self.countNotPairedOther=self.countNotPairedOther+other.countNotPairedOther
+        self.pairedLen.merge(other.pairedLen)
+        self.nonPairedLen.merge(other.nonPairedLen)
+        self.mateLoci.extend(other.mateLoci)
+
+    #a read without its mate in the region; TLEN is counted only if the mate is on the same contig
+    def addNotPaired(self,TLEN,sameContig,mateLocus):
+        self.countNotPaired=self.countNotPaired+1
+        if sameContig:
+            self.countNotPairedSame=self.countNotPairedSame+1
+            self.nonPairedLen.add(abs(TLEN))
+        else:
             #this is a translocation
-            countNotPairedOther=countNotPairedOther+1
-        elif len(pairFound)==2:
-        #check for error
-          tmp=idx.split("\t")
-          QNAME=tmp[0]
-          FLAG=tmp[1]
-          RNAME=tmp[2]
-          POS=tmp[3]
-          MAPQ=tmp[4]
-          CIGAR=tmp[5]
-          RNEXT=tmp[6]
-          PNEXT=tmp[7]
-          TLEN=tmp[8]
-          myLen=int(TLEN)
-          if myLen>0:
-            pairedLen.append(myLen)
-          countReadPairs=countReadPairs+1
+            self.countNotPairedOther=self.countNotPairedOther+1
+        if mateLocus is not None:
+            self.mateLoci.append(mateLocus)
+
+    #the results in the order of formatReportRow; mateFound has the answers of lookUpMates for the mates of the region
+    def results(self,countFetches=0,mateFound=None):
+        mateResults=None
+        if mateFound is not None:
+            mateResults=(countFetches,sum([1 for eachLocus in self.mateLoci if mateFound[eachLocus]]))
+        return (self.countTotalReads,self.countReadPairs,self.countNotPaired,self.countNotPairedSame,self.countNotPairedOther,
+                self.pairedLen,self.nonPairedLen,mateResults)
+
+#the read groups of the header with their library, for groupBy=LB
+def readGroupLibraries(myBam):
+    libraries={}
+    for eachGroup in myBam.header.to_dict().get('RG',[]):
+        libraries[eachGroup['ID']]=eachGroup.get('LB','NA')
+    return libraries
+
+#this function fetches all reads spanning the region from the indexed bam file and computes the number of reads,
+#the number of paired and not paired ones and the histograms of the insert sizes (TLEN field)
+#the reads with mapping quality lower than quality are skipped, as samtools view -q did in the first version
+#the mates are paired while the reads are streamed: a read waits in pendingMates with only (TLEN, mate position, FLAG, group)
+#until its mate arrives, or until the sorted stream has passed the mate position and the mate cannot come any more,
+#so the memory depends on the fragment length and the coverage and not on the size of the region
+#secondary and supplementary alignments are counted as reads but they are not used for the pairs
+#with resolveMates the mates of the not paired reads are looked up outside the region with lookUpMates
+#with groupBy (RG or LB) the reads are counted by their read group or library in the same pass
+#it returns a list of (group, results), sorted by group and followed by the results of all reads as group ALL;
+#without groupBy the list has only the results of all reads, with group None
+def analyseRegion(myBam,chrom,startPos,endPos,maxInsertSize=MAX_INSERT_SIZE,rawLengths=False,resolveMates=False,mateCache=None,groupBy=None):
+    countNotPrimary=0
+    allCounts=RegionCounts(maxInsertSize,rawLengths)
+    groupCounts={}
+    if groupBy=='LB':
+        libraries=readGroupLibraries(myBam)
+    groupName=None
+    counts=allCounts
+    #the key is the QNAME; mateHeap keeps (mate position, QNAME) so the reads whose mate cannot come are found first
+    pendingMates={}
+    mateHeap=[]
+    tid=myBam.get_tid(chrom)
+    for read in myBam.fetch(chrom,int(startPos),int(endPos)):
+        if read.mapping_quality<quality:
+            continue
+        if groupBy is not None:
+            try:
+                groupName=read.get_tag('RG')
+            except KeyError:
+                groupName='NA'
+            if groupBy=='LB':
+                groupName=libraries.get(groupName,'NA')
+            if groupName not in groupCounts:
+                groupCounts[groupName]=RegionCounts(maxInsertSize,rawLengths)
+            counts=groupCounts[groupName]
+        counts.countTotalReads=counts.countTotalReads+1
+        if read.flag&0x900:
+            countNotPrimary=countNotPrimary+1
+            continue
+        POS=read.reference_start
+        #the mates that should start before this read are not in the region
+        while mateHeap and mateHeap[0][0]<POS:
+            PNEXT,QNAME=heapq.heappop(mateHeap)
+            if QNAME in pendingMates and pendingMates[QNAME][1]==PNEXT:
+                TLEN,PNEXT,FLAG,pendingGroup=pendingMates.pop(QNAME)
+                mateLocus=None
+                if resolveMates and FLAG&0x1 and not FLAG&0x8:
+                    mateLocus=(tid,PNEXT,QNAME,not FLAG&0x40)
+                pendingGroup.addNotPaired(TLEN,True,mateLocus)
+        QNAME=read.query_name
+        if QNAME in pendingMates:
+            #the second mate arrived; both reads are paired
+            TLEN=pendingMates.pop(QNAME)[0]
+            if TLEN>0:
+                counts.pairedLen.add(TLEN)
+            if read.template_length>0:
+                counts.pairedLen.add(read.template_length)
+            counts.countReadPairs=counts.countReadPairs+2
+        elif read.next_reference_id!=tid:
+            #the mate is never in the region
+            mateLocus=None
+            if resolveMates and read.is_paired and not read.mate_is_unmapped:
+                mateLocus=(read.next_reference_id,read.next_reference_start,QNAME,not read.is_read1)
+            counts.addNotPaired(read.template_length,False,mateLocus)
         else:
-          print('Malakia paizei edo:%s'%idx)
-    #print('Reads:%d\tReadsPaired:%d\tReadsNotPaired:%d\tReadsSame:%s\tReadsNotSame:%d\n'%(countTotalReads,countReadPairs,countNotPaired,countNotPairedSame,countNotPairedOther))
-    #print('Paired len:%s\n\n\n'%pairedLen)
-    #print('Non paired len:%s\n\n\n'%nonPairedLen)
-    OutReportFile.write('%s\t%s\t%s\t%d\t%d\t%s\t%s\t%s\t%s\t'%(chrom,startPos,endPos,regionSize,countTotalReads,countReadPairs,countNotPaired,countNotPairedSame,countNotPairedOther)),
-    k=0
-    for idx in pairedLen:
-      if k==0:
-        OutReportFile.write('%d'%idx),
-        k=k+1
-      else:
-        OutReportFile.write(':%d'%idx),
-        k=k+1
-    OutReportFile.write('\t'),
-    k=0
-    for idx in nonPairedLen:
-      if k==0:
-        OutReportFile.write('%d'%idx),
-        k=k+1
-      else:
-        OutReportFile.write(':%d'%idx),
-        k=k+1
-    OutReportFile.write('\n')
-    OutReportFile.close()
-  else:
+            pendingMates[QNAME]=(read.template_length,read.next_reference_start,read.flag,counts)
+            heapq.heappush(mateHeap,(read.next_reference_start,QNAME))
+    #the reads still waiting have no mate in the region
+    for QNAME in pendingMates:
+        TLEN,PNEXT,FLAG,pendingGroup=pendingMates[QNAME]
+        mateLocus=None
+        if resolveMates and FLAG&0x1 and not FLAG&0x8:
+            mateLocus=(tid,PNEXT,QNAME,not FLAG&0x40)
+        pendingGroup.addNotPaired(TLEN,True,mateLocus)
+    if countNotPrimary>0:
+        print('Warning: %d secondary or supplementary alignments in %s:%s-%s are counted as reads but not used for the pairs.'%(countNotPrimary,chrom,startPos,endPos))
+    groupNames=sorted(groupCounts)
+    for eachGroup in groupNames:
+        allCounts.merge(groupCounts[eachGroup])
+    countFetches=0
+    mateFound=None
+    if resolveMates:
+        countFetches,mateFound=lookUpMates(myBam,allCounts.mateLoci,mateCache)
+    if groupBy is None:
+        return [(None,allCounts.results(countFetches,mateFound))]
+    #the fetches of the mates are shared by the groups, so they are given only in the row of all reads
+    return [(eachGroup,groupCounts[eachGroup].results(0,mateFound)) for eachGroup in groupNames]+[('ALL',allCounts.results(countFetches,mateFound))]
+
+#look up the mates of the not paired reads outside the region; a mate is found if its primary alignment is at PNEXT
+#with mapping quality at least quality, as for the reads of the region
+#the mate positions of each contig are sorted and the ones closer than MATE_BATCH_GAP are fetched together, so the number
+#of fetches depends on the distinct mate loci and not on the number of reads
+#the answers are kept in mateCache, ordered from the least to the most recently used, for the next regions
+#it returns the number of fetches and a dictionary that tells for every mate locus if the mate was found
+def lookUpMates(myBam,mateLoci,mateCache):
+    mateFound={}
+    wantedLoci=defaultdict(set)
+    for eachLocus in mateLoci:
+        if eachLocus in mateCache:
+            mateFound[eachLocus]=mateCache.pop(eachLocus)
+            mateCache[eachLocus]=mateFound[eachLocus]
+        else:
+            wantedLoci[eachLocus[0]].add(eachLocus[1:])
+    countFetches=0
+    for mateTid in sorted(wantedLoci):
+        contig=myBam.get_reference_name(mateTid)
+        loci=sorted(wantedLoci[mateTid])
+        batchStart=0
+        while batchStart<len(loci):
+            batchEnd=batchStart
+            while batchEnd+1<len(loci) and loci[batchEnd+1][0]-loci[batchEnd][0]<=MATE_BATCH_GAP:
+                batchEnd=batchEnd+1
+            batchLoci=set(loci[batchStart:batchEnd+1])
+            foundLoci=set()
+            countFetches=countFetches+1
+            for read in myBam.fetch(contig,loci[batchStart][0],loci[batchEnd][0]+1):
+                if read.reference_start<loci[batchStart][0] or read.flag&0x900 or read.mapping_quality<quality:
+                    continue
+                eachLocus=(read.reference_start,read.query_name,read.is_read1)
+                if eachLocus in batchLoci:
+                    foundLoci.add(eachLocus)
+            for eachLocus in batchLoci:
+                mateFound[(mateTid,)+eachLocus]=eachLocus in foundLoci
+                mateCache[(mateTid,)+eachLocus]=eachLocus in foundLoci
+                if len(mateCache)>MATE_CACHE_SIZE:
+                    mateCache.popitem(last=False)
+            batchStart=batchEnd+1
+    return countFetches,mateFound
+
+#estimate the insert size of the region from a sample of its fragments
+#every fragment is counted once, by the mate with TLEN>0 and the mate on the same contig, when this mate starts in the region
+#with sampleFraction a fragment is kept if the hash of its QNAME is lower than sampleFraction, so both mates of a pair
+#get the same decision and every run takes the same sample
+#with samplePairs the region is read in blocks in a fixed random order and the reading stops as soon as samplePairs
+#fragments are kept; a block gives at most the fragments still needed divided by the smaller of SAMPLE_MIN_BLOCKS and the
+#blocks left, so the sample comes from at least SAMPLE_MIN_BLOCKS blocks (all the blocks of a smaller region) and a block
+#that is not typical of the region, e.g. a deletion or a repeat, gives only a small part of it
+def sampleRegion(myBam,chrom,startPos,endPos,samplePairs=0,sampleFraction=1.0,maxInsertSize=MAX_INSERT_SIZE):
+    tid=myBam.get_tid(chrom)
+    blocks=list(range(int(startPos),int(endPos),SAMPLE_BLOCK))
+    if samplePairs>0:
+        random.Random(SAMPLE_SEED).shuffle(blocks)
+    hashLimit=int(sampleFraction*0x100000000)
+    sampledLen=InsertSizeHistogram(maxInsertSize)
+    countSampled=0
+    blocksRead=0
+    for blockStart in blocks:
+        if samplePairs>0 and countSampled>=samplePairs:
+            break
+        blockQuota=0
+        if samplePairs>0:
+            blockQuota=int(math.ceil(float(samplePairs-countSampled)/min(SAMPLE_MIN_BLOCKS,len(blocks)-blocksRead)))
+        blocksRead=blocksRead+1
+        countBlock=0
+        for read in myBam.fetch(chrom,blockStart,min(blockStart+SAMPLE_BLOCK,int(endPos))):
+            #the reads starting before the block are counted in the block where they start
+            if read.reference_start<blockStart or read.mapping_quality<quality or read.flag&0x900:
+                continue
+            TLEN=read.template_length
+            if TLEN<=0 or read.next_reference_id!=tid:
+                continue
+            if hashLimit<0x100000000 and (zlib.crc32(read.query_name.encode('ascii'))&0xffffffff)>=hashLimit:
+                continue
+            sampledLen.add(TLEN)
+            countSampled=countSampled+1
+            countBlock=countBlock+1
+            if countBlock==blockQuota:
+                break
+    return blocksRead,len(blocks),sampledLen
+
+#format the results of the sampling mode for one region as a row of the report; a region without fragments gives NA
+def formatSampleRow(chrom,startPos,endPos,results):
+    blocksRead,numBlocks,sampledLen=results
+    row='%s\t%s\t%s\t%d\t%d%s'%(chrom,startPos,endPos,blocksRead,numBlocks,formatSummary(sampledLen))
+    if sampledLen.count()==0:
+        return row+'\tNA\tNA\tNA\tNA\n'
+    return row+'\t%.2f\t%.2f\t%d\t%d\n'%sampledLen.confidenceIntervals()
+
+#header of the report; with rawLengths the insert sizes are also written joined by ':'
+#with resolveMates the columns of the mates outside the region come before them
+#with groupBy the column GROUP, with the read group or library of each row, comes after END
+def reportHeader(rawLengths=False,sampling=False,resolveMates=False,groupBy=None):
+    if sampling:
+        return SAMPLE_HEADER
+    header=REPORT_HEADER
+    if groupBy is not None:
+        header=header.replace('\tEND\t','\tEND\tGROUP\t')
+    if resolveMates:
+        header=header+MATE_HEADER
+    if rawLengths:
+        return header+'\tDIST_PAIRED\tDIST_NO_PAIRED\n'
+    return header+'\n'
+
+#format the summary of a histogram as columns of the report; a histogram without sizes gives NA
+def formatSummary(myHistogram):
+    numSizes,mean,median,mad,p5,p95,mode=myHistogram.summary()
+    if numSizes==0:
+        return '\t0'+'\tNA'*(len(SUMMARY_FIELDS)-1)
+    return '\t%d\t%.2f\t%.1f\t%.1f\t%.1f\t%.1f\t%d'%(numSizes,mean,median,mad,p5,p95,mode)
+
+#format the results of one region, or of one read group of the region, as a row of the report
+#with the mates looked up outside the region, the not paired reads with a mate found are counted in CORRECTED_PAIRED
+def formatReportRow(chrom,startPos,endPos,results,rawLengths=False,groupName=None):
+    countTotalReads,countReadPairs,countNotPaired,countNotPairedSame,countNotPairedOther,pairedLen,nonPairedLen,mateResults=results
+    regionSize=int(endPos)-int(startPos)
+    row='%s\t%s\t%s'%(chrom,startPos,endPos)
+    if groupName is not None:
+        row=row+'\t'+groupName
+    row=row+'\t%d\t%d\t%d\t%d\t%d\t%d'%(regionSize,countTotalReads,countReadPairs,countNotPaired,countNotPairedSame,countNotPairedOther)
+    row=row+formatSummary(pairedLen)+formatSummary(nonPairedLen)
+    if mateResults is not None:
+        countFetches,countMatesOutside=mateResults
+        row=row+'\t%d\t%d\t%d\t%d'%(countFetches,countMatesOutside,countReadPairs+countMatesOutside,countNotPaired-countMatesOutside)
+    if rawLengths:
+        row=row+'\t%s\t%s'%(':'.join([str(idx) for idx in pairedLen.raw]),':'.join([str(idx) for idx in nonPairedLen.raw]))
+    return row+'\n'
+
+#format the bins with reads of the histograms of one region, given as (type,histogram), as rows of the histogram file
+#the last bin, maxInsertSize+1, counts all the larger insert sizes; with groupBy the type is group:PAIRED or group:NO_PAIRED
+def formatHistogramRows(chrom,startPos,endPos,histograms):
+    rows=[]
+    for histType,myHistogram in histograms:
+        myHistogram.flush()
+        for size in np.nonzero(myHistogram.counts)[0]:
+            rows.append('%s\t%s\t%s\t%s\t%d\t%d\n'%(chrom,startPos,endPos,histType,size,myHistogram.counts[size]))
+    return ''.join(rows)
+
+#read the intervals of a bed file; the positions are kept as they are written in the bed file
+def readBedFile(bedFile):
+    regions=[]
+    if os.path.exists(bedFile):
+        InBedFile=open(bedFile,'r')
+        for eachLine in InBedFile:
+            line=eachLine.rstrip('\n')
+            if line=='' or line.startswith('#') or line.startswith('track') or line.startswith('browser'):
+                continue
+            tmp=line.split('\t')
+            regions.append((tmp[0],tmp[1],tmp[2]))
+        InBedFile.close()
+    else:
         ts = time.time()
         st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-        print('[%s] ERROR from function: parseSamFile. The input sam file does not exist!\n'%(st))
+        print('[%s] ERROR from function: readBedFile. The bed file does not exist!\n'%(st))
         print('************************************************************************************************************************************\n')
         sys.exit()
-
-#just remove the big sam file..
-def clearIntermResults(samFileName):
-  command='rm '+samFileName
-  os.system(command)
+    return regions
+
+#every worker process opens the bam file once and keeps it for all regions it analyses
+#with samplePairs or sampleFraction the workers run the sampling mode
+#with resolveMates every worker keeps its own cache of the mates looked up outside the regions
+#with groupBy the reads are counted by read group (RG) or library (LB)
+def initRegionWorker(bamFile,maxInsertSize=MAX_INSERT_SIZE,rawLengths=False,samplePairs=0,sampleFraction=1.0,resolveMates=False,groupBy=None):
+    global workerBam,workerMaxInsertSize,workerRawLengths,workerSamplePairs,workerSampleFraction,workerResolveMates,workerMateCache,workerGroupBy
+    workerBam=openBamFile(bamFile)
+    workerMaxInsertSize=maxInsertSize
+    workerRawLengths=rawLengths
+    workerSamplePairs=samplePairs
+    workerSampleFraction=sampleFraction
+    workerResolveMates=resolveMates
+    workerMateCache=OrderedDict()
+    workerGroupBy=groupBy
+
+#analyse one region and return its rows of the report (one row, or one per group and one for all reads) and of the histogram file
+#a region on a contig that is not in the bam file gets a row with zero reads
+def processRegion(region):
+    chrom,startPos,endPos=region
+    missingContig=workerBam.get_tid(chrom)<0
+    if missingContig:
+        print('Warning: The contig %s is not in the bam file; the region %s:%s-%s has no reads.'%(chrom,chrom,startPos,endPos))
+    if workerSamplePairs>0 or workerSampleFraction<1.0:
+        if missingContig:
+            results=(0,0,InsertSizeHistogram(workerMaxInsertSize))
+        else:
+            results=sampleRegion(workerBam,chrom,startPos,endPos,workerSamplePairs,workerSampleFraction,workerMaxInsertSize)
+        return formatSampleRow(chrom,startPos,endPos,results),formatHistogramRows(chrom,startPos,endPos,[('SAMPLED',results[2])])
+    if missingContig:
+        mateFound=None
+        if workerResolveMates:
+            mateFound={}
+        groupName=None
+        if workerGroupBy is not None:
+            groupName='ALL'
+        groupResults=[(groupName,RegionCounts(workerMaxInsertSize,workerRawLengths).results(0,mateFound))]
+    else:
+        groupResults=analyseRegion(workerBam,chrom,startPos,endPos,workerMaxInsertSize,workerRawLengths,workerResolveMates,workerMateCache,workerGroupBy)
+    reportRows=[]
+    histograms=[]
+    for groupName,results in groupResults:
+        reportRows.append(formatReportRow(chrom,startPos,endPos,results,workerRawLengths,groupName))
+        if groupName is None:
+            histograms.extend([('PAIRED',results[5]),('NO_PAIRED',results[6])])
+        else:
+            histograms.extend([(groupName+':PAIRED',results[5]),(groupName+':NO_PAIRED',results[6])])
+    return ''.join(reportRows),formatHistogramRows(chrom,startPos,endPos,histograms)
+
+#analyse all regions of the bed file with a pool of worker processes and write one report and one histogram file
+#with the rows in the order of the bed file
+#with one thread the regions are analysed in this process; the progress is printed as regions per second
+def analyseBedFile(bamFile,regions,reportFile,histogramFile,threads=1,maxInsertSize=MAX_INSERT_SIZE,rawLengths=False,samplePairs=0,sampleFraction=1.0,resolveMates=False,groupBy=None):
+    if threads>1:
+        myPool=multiprocessing.Pool(threads,initRegionWorker,(bamFile,maxInsertSize,rawLengths,samplePairs,sampleFraction,resolveMates,groupBy))
+        #imap returns the rows in the order of the regions; small batches of regions keep the workers busy
+        rows=myPool.imap(processRegion,regions,max(1,min(100,len(regions)//(threads*4))))
+    else:
+        initRegionWorker(bamFile,maxInsertSize,rawLengths,samplePairs,sampleFraction,resolveMates,groupBy)
+        rows=(processRegion(eachRegion) for eachRegion in regions)
+    OutReportFile=open(reportFile,'w')
+    OutReportFile.write(reportHeader(rawLengths,samplePairs>0 or sampleFraction<1.0,resolveMates,groupBy))
+    OutHistogramFile=open(histogramFile,'w')
+    OutHistogramFile.write(HISTOGRAM_HEADER)
+    startTime=time.time()
+    lastProgress=startTime
+    countRegions=0
+    for eachRow,histogramRows in rows:
+        OutReportFile.write(eachRow)
+        OutHistogramFile.write(histogramRows)
+        countRegions=countRegions+1
+        if time.time()-lastProgress>=PROGRESS_INTERVAL:
+            lastProgress=time.time()
+            print('Processed %d of %d regions (%.1f regions/sec)'%(countRegions,len(regions),countRegions/(lastProgress-startTime)))
+    OutReportFile.close()
+    OutHistogramFile.close()
+    if threads>1:
+        myPool.close()
+        myPool.join()
+    elapsed=max(time.time()-startTime,1e-6)
+    print('Processed %d regions in %.1f sec (%.1f regions/sec)'%(countRegions,elapsed,countRegions/elapsed))
+
+#compute the insert size profile of one contig in one pass over its reads
+#every fragment is counted once, by the mate with TLEN>0, in the step of the genome that has the middle of the fragment
+#a window is the sum of windowSize/step consecutive steps; since the reads are sorted and the middle of the fragment is after
+#the start of the read, a step is complete once the reads start after it, and the window can be written and moved by one step
+def profileContig(myBam,contig,windowSize,step,maxInsertSize=MAX_INSERT_SIZE):
+    contigLen=myBam.get_reference_length(contig)
+    tid=myBam.get_tid(contig)
+    stepsPerWindow=windowSize//step
+    numWindows=(contigLen+step-1)//step
+    #the histograms of the steps that are not yet out of the windows; the key is the index of the step
+    stepHistograms=defaultdict(lambda: InsertSizeHistogram(maxInsertSize))
+    #the sum of the steps nextWindow to nextWindow+stepsPerWindow-1
+    windowHistogram=InsertSizeHistogram(maxInsertSize)
+    nextWindow=0
+    rows=[]
+    for read in myBam.fetch(contig):
+        if read.mapping_quality<quality or read.flag&0x900:
+            continue
+        TLEN=read.template_length
+        if TLEN<=0 or read.next_reference_id!=tid:
+            continue
+        POS=read.reference_start
+        while nextWindow<numWindows and (nextWindow+stepsPerWindow)*step<=POS:
+            rows.append(formatProfileRow(contig,nextWindow,windowSize,step,contigLen,windowHistogram))
+            windowHistogram.remove(stepHistograms.pop(nextWindow,InsertSizeHistogram(maxInsertSize)))
+            if nextWindow+stepsPerWindow in stepHistograms:
+                windowHistogram.merge(stepHistograms[nextWindow+stepsPerWindow])
+            nextWindow=nextWindow+1
+        stepIdx=min(POS+TLEN//2,contigLen-1)//step
+        stepHistograms[stepIdx].add(TLEN)
+        if stepIdx<nextWindow+stepsPerWindow:
+            windowHistogram.add(TLEN)
+    #the windows after the last read
+    while nextWindow<numWindows:
+        rows.append(formatProfileRow(contig,nextWindow,windowSize,step,contigLen,windowHistogram))
+        windowHistogram.remove(stepHistograms.pop(nextWindow,InsertSizeHistogram(maxInsertSize)))
+        if nextWindow+stepsPerWindow in stepHistograms:
+            windowHistogram.merge(stepHistograms[nextWindow+stepsPerWindow])
+        nextWindow=nextWindow+1
+    return ''.join(rows)
+
+#format the summary of one window of the profile; the last windows end at the end of the contig
+def formatProfileRow(contig,windowIdx,windowSize,step,contigLen,windowHistogram):
+    windowStart=windowIdx*step
+    return '%s\t%d\t%d%s\n'%(contig,windowStart,min(windowStart+windowSize,contigLen),formatSummary(windowHistogram))
+
+#compute the profile of one contig in a worker process; the window and step are given with the contig
+def processContig(contigArgs):
+    contig,windowSize,step=contigArgs
+    return profileContig(workerBam,contig,windowSize,step,workerMaxInsertSize)
+
+#write the genome-wide insert size profile; the contigs are processed in parallel by a pool of worker processes
+#and written in the order of the bam header
+def profileBamFile(bamFile,profileFile,windowSize=PROFILE_WINDOW,step=PROFILE_STEP,threads=1,maxInsertSize=MAX_INSERT_SIZE):
+    myBam=openBamFile(bamFile)
+    tasks=[(contig,windowSize,step) for contig in myBam.references]
+    myBam.close()
+    if threads>1:
+        myPool=multiprocessing.Pool(threads,initRegionWorker,(bamFile,maxInsertSize,False))
+        contigRows=myPool.imap(processContig,tasks)
+    else:
+        initRegionWorker(bamFile,maxInsertSize,False)
+        contigRows=(processContig(eachTask) for eachTask in tasks)
+    OutProfileFile=open(profileFile,'w')
+    OutProfileFile.write(PROFILE_HEADER)
+    for eachRows in contigRows:
+        OutProfileFile.write(eachRows)
+    OutProfileFile.close()
+    if threads>1:
+        myPool.close()
+        myPool.join()
+
+#parse the optional arguments given after the mandatory ones; all of them are in the format name=value
+def parseOptionalArgs(argList):
+    options={}
+    for eachArg in argList:
+        tmp=eachArg.split('=',1)
+        if len(tmp)!=2 or tmp[0] not in OPTIONAL_ARGS:
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: parseOptionalArgs. The argument %s is not recognised!\n'%(st,eachArg))
+            print('************************************************************************************************************************************\n')
+            printUsage()
+            sys.exit()
+        options[tmp[0]]=tmp[1]
+    return options
+
+#write the report and the histogram file with their headers and the rows of the regions
+def writeReport(reportFile,header,rows,histogramFile,histogramRows):
+    OutReportFile=open(reportFile,'w')
+    OutReportFile.write(header)
+    for eachRow in rows:
+        OutReportFile.write(eachRow)
+    OutReportFile.close()
+    OutHistogramFile=open(histogramFile,'w')
+    OutHistogramFile.write(HISTOGRAM_HEADER)
+    for eachRow in histogramRows:
+        OutHistogramFile.write(eachRow)
+    OutHistogramFile.close()
 
 #main function of the program
 def myMain():
     #check the number of input arguments
-    if len(sys.argv)!=3:
+    if len(sys.argv)<3 or not (sys.argv[2].startswith('region=') or sys.argv[2].startswith('bedFile=') or sys.argv[2]=='profile=yes'):
         print('************************************************************************************************************************************\n')
         print('\t\t\t\t\tYour input arguments are not correct!\n')
         print('\t\t\t\tCEC Bioinformatics\n')
@@ -266,46 +839,138 @@ def myMain():
         #here if the user does not write the correct argument name it gets an error and the program stops
         bamFile=sys.argv[1].split('bamFile=')
         bamFile=bamFile[1]
-        #parse the second argument
-        region=sys.argv[2].split('region=')
-        region=region[1]
-        region=region.split(':')
-        chrom=region[0]
-        positions=region[1].split('-')
-        startPos=positions[0]
-        endPos=positions[1]
+        #parse the second argument; it is one region, a bed file with many regions or the profile of the whole genome
+        region='-'
+        bedFile='-'
+        profile='no'
+        if sys.argv[2].startswith('region='):
+            region=sys.argv[2].split('region=')[1]
+            tmp=region.split(':')
+            chrom=tmp[0]
+            #only the contig name gives the whole contig; its end is read from the bam file below
+            startPos='0'
+            endPos='-'
+            if len(tmp)>1:
+                positions=tmp[1].split('-')
+                startPos=positions[0]
+                endPos=positions[1]
+        elif sys.argv[2].startswith('bedFile='):
+            bedFile=sys.argv[2].split('bedFile=')[1]
+        else:
+            profile='yes'
+        #parse the optional arguments
+        options=parseOptionalArgs(sys.argv[3:])
+        threads=int(options.get('threads',1))
+        maxInsertSize=int(options.get('maxInsertSize',MAX_INSERT_SIZE))
+        rawLengths=options.get('rawLengths','no')
+        windowSize=int(options.get('window',PROFILE_WINDOW))
+        step=int(options.get('step',PROFILE_STEP))
+        samplePairs=int(options.get('samplePairs',0))
+        sampleFraction=float(options.get('sampleFraction',1.0))
+        sampling=samplePairs>0 or sampleFraction<1.0
+        if sampling and profile=='yes':
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: myMain. The sampling is available for region and bedFile, not for profile!\n'%(st))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
+        resolveMates=options.get('resolveMates','no')
+        groupBy=options.get('groupBy','-')
+        if (resolveMates=='yes' or groupBy!='-') and (sampling or profile=='yes'):
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: myMain. resolveMates and groupBy are available for region and bedFile, without sampling!\n'%(st))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
+        if groupBy not in ['-','RG','LB']:
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: myMain. groupBy has to be RG or LB!\n'%(st))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
+        groupByArg=None
+        if groupBy!='-':
+            groupByArg=groupBy
+        if profile=='yes' and (step<=0 or windowSize<step or windowSize%step!=0):
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: myMain. The window has to be a multiple of the step!\n'%(st))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
 
         #print the arguments given by user; is good for 'self' debugging
         print('Execution started with the following parameters:\n')
         print('1. bamFile:         \t\t\t\t%s' % bamFile)
-        print('2. region :         \t\t\t\t%s\t%s\t%s' % (chrom,startPos,endPos))
+        if region!='-':
+            print('2. region :         \t\t\t\t%s\t%s\t%s' % (chrom,startPos,endPos))
+        elif bedFile!='-':
+            print('2. bedFile:         \t\t\t\t%s' % bedFile)
+        else:
+            print('2. profile:         \t\t\t\twindow %d step %d' % (windowSize,step))
+        print('3. threads:         \t\t\t\t%d' % threads)
+        print('4. maxInsertSize:   \t\t\t\t%d' % maxInsertSize)
+        print('5. rawLengths:      \t\t\t\t%s' % rawLengths)
+        print('6. samplePairs:     \t\t\t\t%d' % samplePairs)
+        print('7. sampleFraction:  \t\t\t\t%s' % sampleFraction)
+        print('8. resolveMates:    \t\t\t\t%s' % resolveMates)
+        print('9. groupBy:         \t\t\t\t%s' % groupBy)
         
-        #generate the sam file
-        ts = time.time()
-        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-        print('\n[%s] Function generateSamFile: produce SAM file for the region of interest'%(st))
         #save the bam file prefix for further naming of files
         bamFilePrefix=bamFile[:-4]
-        #generate folders for storing the final results and the intermediate results
+        #generate the folder for storing the final results
         RESULTS=bamFilePrefix+'/RESULTS'
-        SAM_FILES=bamFilePrefix+'/INTERM_FILES'
-        command='mkdir -p '+bamFilePrefix+' && mkdir -p '+RESULTS+' && mkdir -p '+SAM_FILES
-        os.system(command)
-        #use the prefix to generate the sam file name
-        samFileName=SAM_FILES+'/'+bamFilePrefix+'_'+chrom+'_'+startPos+'_'+endPos+'.intervalSam'
-        generateSamFile(bamFile,samFileName,chrom,startPos,endPos,SAM_FILES)
-
-        #generate the output
-        ts = time.time()
-        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-        print('\n[%s] Function parseSamFile: parse the SAM file and produce the results'%(st))
-        parseSamFile(samFileName,bamFilePrefix,chrom,startPos,endPos,RESULTS)
-        
-        #clear the intermediate results because the SAM file can be very big...
-        ts = time.time()
-        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-        print('\n[%s] Function clearIntermResults: remove the SAM file from the disk '%(st))
-        clearIntermResults(samFileName)
+        if not os.path.isdir(RESULTS):
+            os.makedirs(RESULTS)
+
+        if region!='-':
+            #fetch the reads of the region and produce the results
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            if sampling:
+                print('\n[%s] Function sampleRegion: estimate the insert size from a sample of the fragments of the region'%(st))
+            else:
+                print('\n[%s] Function analyseRegion: fetch the reads of the region and produce the results'%(st))
+            initRegionWorker(bamFile,maxInsertSize,rawLengths=='yes',samplePairs,sampleFraction,resolveMates=='yes',groupByArg)
+            if endPos=='-':
+                if workerBam.get_tid(chrom)<0:
+                    ts = time.time()
+                    st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+                    print('[%s] ERROR from function: myMain. The contig %s is not in the bam file!\n'%(st,chrom))
+                    print('************************************************************************************************************************************\n')
+                    sys.exit()
+                endPos=str(workerBam.get_reference_length(chrom))
+            reportRow,histogramRows=processRegion((chrom,startPos,endPos))
+            workerBam.close()
+            if sampling:
+                reportFile=RESULTS+'/'+bamFilePrefix+'_'+chrom+'_'+startPos+'_sample_report.txt'
+                histogramFile=RESULTS+'/'+bamFilePrefix+'_'+chrom+'_'+startPos+'_sample_histogram.txt'
+            else:
+                reportFile=RESULTS+'/'+bamFilePrefix+'_'+chrom+'_'+startPos+'_report.txt'
+                histogramFile=RESULTS+'/'+bamFilePrefix+'_'+chrom+'_'+startPos+'_histogram.txt'
+            writeReport(reportFile,reportHeader(rawLengths=='yes',sampling,resolveMates=='yes',groupByArg),[reportRow],histogramFile,[histogramRows])
+        elif profile=='yes':
+            #profile the insert sizes along the whole genome
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('\n[%s] Function profileBamFile: profile the insert sizes in windows of %d bp every %d bp with %d processes'%(st,windowSize,step,threads))
+            profileFile=RESULTS+'/'+bamFilePrefix+'_profile_%d_%d.bedGraph'%(windowSize,step)
+            profileBamFile(bamFile,profileFile,windowSize,step,threads,maxInsertSize)
+        else:
+            #analyse all regions of the bed file and produce one report
+            regions=readBedFile(bedFile)
+            #check the bam file once here, so the workers do not all report the same error
+            openBamFile(bamFile).close()
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('\n[%s] Function analyseBedFile: analyse %d regions with %d processes'%(st,len(regions),threads))
+            bedName=os.path.basename(bedFile)
+            if bedName.endswith('.bed'):
+                bedName=bedName[:-4]
+            if sampling:
+                bedName=bedName+'_sample'
+            reportFile=RESULTS+'/'+bamFilePrefix+'_'+bedName+'_report.txt'
+            histogramFile=RESULTS+'/'+bamFilePrefix+'_'+bedName+'_histogram.txt'
+            analyseBedFile(bamFile,regions,reportFile,histogramFile,threads,maxInsertSize,rawLengths=='yes',samplePairs,sampleFraction,resolveMates=='yes',groupByArg)
         print('************************************************************************************************************************************\n')
 
 #this is where we start
@@ -36,7 +36,9 @@ BEGIN COPYRIGHT NOTICE
 END COPYRIGHT NOTICE
  
 UTILITY
-   This program takes as input a bam file and generates a typical sam file as well as a Flat file that interprets the CIGAR per genomic position.
+   This program takes as input a bam file and generates a Flat file that interprets the CIGAR per genomic position.
+   The reads are streamed directly from the bam file; the older behaviour that first writes a typical sam file
+   and then parses it is still available with the optional argument writeSam=yes.
 
 
 INPUT ARGUMENTS
@@ -44,6 +46,69 @@ INPUT ARGUMENTS
     1. bam file                 : a bam file
     
     2. reference                : the reference genome in fasta format
+
+    Optional arguments (given after the mandatory ones in the format name=value)
+
+    writeSam=yes                : write the intermediate sam file and parse it, as in the first version of the program
+
+    refWindow=4000000           : size in bp of each window of the reference genome kept in memory
+
+    refCacheSize=4              : number of reference windows kept in memory; the least recently used is removed first.
+                                  Increase it if the bam file is not sorted by coordinate.
+
+    threads=1                   : number of worker processes; with more than one the genome is split in chunks
+                                  that are processed in parallel and merged in reference order. Needs a sorted and indexed bam file.
+                                  The chunks are written in a folder with the name of the output and suffix .chunks, removed at the end.
+
+    chunkSize=0                 : size in bp of the genomic chunks used with threads; 0 means one chunk per contig
+
+    outputFormat=txt            : txt gives the TAB limited flat file. columnar, parquet or npz write the same table in columns
+                                  in a folder with suffix _flat_parquet or _flat_npz. columnar uses parquet if pyarrow is installed
+                                  and npz files of numpy otherwise. QNAME and CHROM are dictionary-encoded, positions are integers
+                                  (-1 if missing), CIGAR_FLAG, REF and BASE are one ASCII byte and VARIANT is boolean.
+
+    variantsOnly=yes            : write only the rows of mismatches (VARIANT is YES) and of insertions/deletions (CIGAR flags I and D).
+                                  For reads with the MD tag these rows are found from MD and CIGAR without the reference genome,
+                                  which is much faster; the other reads use the reference genome as usual.
+
+    region=chr1:100-2000        : convert only the reads overlapping the region, using the index of the bam file.
+                                  The region is 1-based as in samtools; chr1:100 goes up to the end of the contig and a contig name alone is the whole contig.
+
+    bedFile=file.bed            : convert only the reads overlapping the intervals of the bed file (0-based as usual for bed).
+                                  With region and/or bedFile the rows are clipped to the intervals; rows of S and I take the position
+                                  of the next reference base. A read spanning several intervals is written once.
+
+    aggregate=yes               : instead of the flat file write a file with suffix _pileup.txt with one row per covered reference
+                                  position: the reference base, the depth, the count of A, C, G, T and N, the number of insertions
+                                  (counted at the position before them) and deletions, and the mismatch rate per MAPQ bin.
+                                  It works in one streaming pass over the sorted and indexed bam file and it can be combined
+                                  with threads, chunkSize, region and bedFile.
+
+    pileupWindow=1000000        : size in bp of the window of counts kept in memory with aggregate=yes
+
+    compress=bgzip              : write the flat file compressed with bgzip, with suffix _flat.txt.gz
+
+    minMapq=0                   : skip the reads with mapping quality lower than minMapq (as samtools view -q)
+
+    excludeFlags=0              : skip the reads with any of these flags, e.g. 0x4 or 3844 (as samtools view -F)
+
+    primaryOnly=yes             : skip the secondary and supplementary alignments (flags 0x100 and 0x800)
+
+    minBaseQual=0               : skip the bases with base quality lower than minBaseQual; in the flat file their rows are not written
+
+    baseQual=yes                : write the base quality of each row in the column BASE_QUAL ('-' for D and N)
+
+    checkpoint=60               : every 60 seconds (at the end of the chunk that is running) write in a file with suffix .checkpoint
+                                  next to the output the last complete chunk, the size in bytes of the output up to it and the
+                                  counts so far. The genome is processed in chunks as with threads (chunks of 10000000 bp if chunkSize
+                                  is 0), so it needs a sorted and indexed bam file. The checkpoint file is removed at the end.
+
+    resume=yes                  : continue a conversion that stopped, with the same arguments, from its checkpoint; the output is
+                                  truncated to the size in the checkpoint and the complete chunks are not processed again.
+                                  The number of threads can be different from the stopped run.
+
+                                  The read filters are checked before the CIGAR of the read is expanded. With any of them the unmapped
+                                  reads and the reads without rows are not written in the flat file.
                               
 OUTPUT 
     
@@ -66,6 +131,8 @@ DEPENDENCIES
 
     The program also depends on samtools, so please make sure that SAMtools is installed and configured properly in your system
 
+    The columnar output and the aggregate mode need numpy, and pyarrow is needed for the parquet files
+
     You might need to add samtools in your path so after you intall SAMtools you might need a command like: 
 
     PATH=$PATH:/your/path/to/Samtools
@@ -88,9 +155,52 @@ import os
 import pysam
 import re
 from collections import defaultdict
+from collections import OrderedDict
 from itertools import groupby
 import datetime
 import time
+import shutil
+import multiprocessing
+import array
+import bisect
+#numpy and pyarrow are needed only for the columnar output of the flat file
+try:
+    import numpy as np
+except ImportError:
+    np=None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa=None
+    pq=None
+
+#the optional arguments that the program accepts after bamFile and referenceGenome
+OPTIONAL_ARGS=['writeSam','refWindow','refCacheSize','threads','chunkSize','outputFormat','variantsOnly','region','bedFile','aggregate','pileupWindow','compress','minMapq','excludeFlags','minBaseQual','primaryOnly','baseQual','checkpoint','resume']
+
+#default size in bp of each reference window loaded in memory and number of windows kept by the reference cache
+REF_WINDOW=4000000
+REF_CACHE_SIZE=4
+
+#number of rows kept in memory before a part of the columnar output is written
+ROWS_PER_PART=2000000
+
+#size in characters of the buffer of the text flat file and the positions in the read with prepared text
+WRITE_BUFFER=8000000
+MAX_READ_POS_TEXT=100000
+
+#with checkpoints and chunkSize 0 the contigs are split in chunks of this size, so a checkpoint is never a whole contig behind
+CHECKPOINT_CHUNK=10000000
+
+#with threads the chunk files are written in the folder with the name of the output and this suffix
+CHUNK_DIR_SUFFIX='.chunks'
+
+#the header of the flat file, VARIANT is YES if the base is different from the reference
+FLAT_HEADER='#QNAME\tCHROM\tREAD_MAPQ\tREAD_POS\tREF_POS\tCIGAR_FLAG\tREF\tBASE\tVARIANT\n'
+
+#size in bp of the window of counts of the aggregate mode and the lower limits of its MAPQ bins
+PILEUP_WINDOW=1000000
+MAPQ_BINS=[0,10,20,30,60]
 
 
 #prints information about program's execution
@@ -101,12 +211,72 @@ def printUsage():
     print('\tfile.bam is a bam file.\n\tThe bam file needs to be indexed with samtools.\n')
     print('\tfile.fa  is a reference genome in fasta format. Please use the same reference you used for the aligment of the bam file.')
     print('\tThe reference genome has to be indexed (produce file .fai and .dict)\n')
+    print('Optional arguments, given after the mandatory ones:\n')
+    print('\twriteSam=yes writes the intermediate sam file and parses it instead of streaming the reads from the bam file.\n')
+    print('\trefWindow=N is the size in bp of each reference window kept in memory (default %d).\n'%REF_WINDOW)
+    print('\trefCacheSize=N is the number of reference windows kept in memory (default %d). Increase it for unsorted bam files.\n'%REF_CACHE_SIZE)
+    print('\tthreads=N processes the genome in parallel chunks with N worker processes (default 1). The bam file must be sorted and indexed.\n')
+    print('\tchunkSize=N splits the contigs in chunks of N bp when threads is used (default 0, one chunk per contig).\n')
+    print('\toutputFormat=txt|columnar|parquet|npz gives the format of the output (default txt). columnar picks parquet if pyarrow is installed, otherwise npz.\n')
+    print('\tvariantsOnly=yes writes only the rows of mismatches and insertions/deletions, using the MD tag of the reads when it exists.\n')
+    print('\tregion=chr:start-end (or chr:start up to the end of the contig) converts only the reads overlapping the region (1-based, as in samtools) and clips the rows to it.\n')
+    print('\tbedFile=file.bed converts only the reads overlapping the intervals of the bed file and clips the rows to them.\n')
+    print('\taggregate=yes writes per-position counts of bases, insertions, deletions and mismatch rate by MAPQ bin instead of the flat file.\n')
+    print('\tpileupWindow=N is the size in bp of the window of counts kept in memory with aggregate=yes (default %d).\n'%PILEUP_WINDOW)
+    print('\tcompress=bgzip writes the flat file compressed with bgzip.\n')
+    print('\tminMapq=N, excludeFlags=N, primaryOnly=yes skip the reads with low mapping quality, with any of the flags or the secondary/supplementary ones.\n')
+    print('\tminBaseQual=N skips the bases with lower base quality and baseQual=yes writes the base quality of each row.\n')
+    print('\tcheckpoint=N writes a checkpoint of the conversion every N seconds and resume=yes continues a stopped conversion from its checkpoint.\n')
 
     print('Execution example:\n') 
     print('\tpython sam2Flat.py bamFile=0097_test.bam referenceGenome=/Users/dkleftog/Desktop/AmpliSolve_Execution_Example/Reference_genome/Louise/hg19.fasta \n')
     print('Please give the arguments in the indicated order similar to the provided example!\n') 
 
 
+#keeps contiguous windows of the reference genome in memory so we do not call FastaFile.fetch for every aligned base
+#with sorted reads the current window slides forward along the contig; with unsorted reads the least recently used window is evicted
+class ReferenceCache(object):
+
+    def __init__(self,myFasta,windowSize=REF_WINDOW,cacheSize=REF_CACHE_SIZE):
+        self.myFasta=myFasta
+        self.windowSize=windowSize
+        self.cacheSize=cacheSize
+        #the key is (contig,windowStart) and the value is (windowEnd,sequence); the last item is the most recently used
+        self.windows=OrderedDict()
+        self.lastKey=None
+        self.lastEnd=0
+        self.lastSeq=''
+
+    #returns the upper case reference sequence between the 0-based positions start and end of the contig
+    #as with FastaFile.fetch, positions after the end of the contig are not returned
+    def fetch(self,contig,start,end):
+        #most of the times the read is in the window we used last
+        if self.lastKey is not None and self.lastKey[0]==contig and self.lastKey[1]<=start and end<=self.lastEnd:
+            offset=start-self.lastKey[1]
+            return self.lastSeq[offset:offset+end-start]
+        for key in reversed(self.windows):
+            windowEnd,windowSeq=self.windows[key]
+            if key[0]==contig and key[1]<=start and end<=windowEnd:
+                #mark the window as the most recently used one
+                del self.windows[key]
+                self.windows[key]=(windowEnd,windowSeq)
+                return self.useWindow(key,windowEnd,windowSeq,start,end)
+        #load a new window that starts at the read and covers at least the whole span of it
+        windowEnd=start+max(self.windowSize,end-start)
+        windowSeq=self.myFasta.fetch(contig,start,windowEnd).upper()
+        key=(contig,start)
+        self.windows[key]=(windowEnd,windowSeq)
+        if len(self.windows)>self.cacheSize:
+            self.windows.popitem(last=False)
+        return self.useWindow(key,windowEnd,windowSeq,start,end)
+
+    def useWindow(self,key,windowEnd,windowSeq,start,end):
+        self.lastKey=key
+        self.lastEnd=windowEnd
+        self.lastSeq=windowSeq
+        offset=start-key[1]
+        return windowSeq[offset:offset+end-start]
+
 #this function takes as input the bamFile of interest and generates the sam file that can be used for further filtering of the reads
 def generateSamFile(bamFile,samFileName):
 #first check if the bam file exists
@@ -124,7 +294,7 @@ def generateSamFile(bamFile,samFileName):
         sys.exit()
 
 #parse the sam file and generate the flat file
-def generateFlatFile(samFileName,flatFileName,refGenome):
+def generateFlatFile(samFileName,flatFileName,refGenome,refWindow=REF_WINDOW,refCacheSize=REF_CACHE_SIZE):
 
     if os.path.exists(samFileName):
         InSamFile=open(samFileName,'r')
@@ -137,6 +307,7 @@ def generateFlatFile(samFileName,flatFileName,refGenome):
             OutFile.write('#QNAME\tCHROM\tREAD_MAPQ\tREAD_POS\tREF_POS\tCIGAR_FLAG\tREF\tBASE\tVARIANT\n')
             #load the reference genome
             myFasta=pysam.FastaFile(refGenome)
+            refCache=ReferenceCache(myFasta,refWindow,refCacheSize)
             for eachLine in InSamFile:
                 #here there is a problem with the TAB delimiting in Python; please be careful !!
                 line = eachLine.rstrip('\n')
@@ -165,7 +336,7 @@ def generateFlatFile(samFileName,flatFileName,refGenome):
                             readPos=readPos+1
                         elif eachFlag=='M':
                             position=refPos
-                            refBase=myFasta.fetch(RNAME,position-1,position)
+                            refBase=refCache.fetch(RNAME,position-1,position)
                             varFlag=''
                             if refBase.upper()==SEQ[readPos].upper():
                                 OutFile.write('%s\t%s\t%s\t%d\t%d\t%s\t%s\t%s\tNO\n'%(QNAME,RNAME,MAPQ,readPos,refPos,eachFlag,refBase.upper(),SEQ[readPos]))
@@ -178,17 +349,17 @@ def generateFlatFile(samFileName,flatFileName,refGenome):
                             readPos=readPos+1
                         elif eachFlag=='D':
                             position=refPos
-                            refBase=myFasta.fetch(RNAME,position-1,position)
+                            refBase=refCache.fetch(RNAME,position-1,position)
                             OutFile.write('%s\t%s\t%s\t-\t%d\t%s\t%s\t-\tNO\n'%(QNAME,RNAME,MAPQ,refPos,eachFlag,refBase.upper()))
                             refPos=refPos+1
                         elif eachFlag=='N':
                             position=refPos
-                            refBase=myFasta.fetch(RNAME,position-1,position)
+                            refBase=refCache.fetch(RNAME,position-1,position)
                             OutFile.write('%s\t%s\t%s\t-\t%d\t%s\t%s\t-\tNO\n'%(QNAME,RNAME,MAPQ,refPos,eachFlag,refBase.upper()))
                             refPos=refPos+1
                         elif eachFlag=='=':
                             position=refPos
-                            refBase=myFasta.fetch(RNAME,position-1,position)
+                            refBase=refCache.fetch(RNAME,position-1,position)
                             varFlag=''
                             if refBase.upper()==SEQ[readPos].upper():
                                 OutFile.write('%s\t%s\t%s\t%d\t%d\t%s\t%s\t%s\tNO\n'%(QNAME,RNAME,MAPQ,readPos,refPos,eachFlag,refBase.upper(),SEQ[readPos]))
@@ -197,7 +368,7 @@ def generateFlatFile(samFileName,flatFileName,refGenome):
                             readPos=readPos+1
                         elif eachFlag=='X':
                             position=refPos
-                            refBase=myFasta.fetch(RNAME,position-1,position)
+                            refBase=refCache.fetch(RNAME,position-1,position)
                             varFlag=''
                             if refBase.upper()==SEQ[readPos].upper():
                                 OutFile.write('%s\t%s\t%s\t%d\t%d\t%s\t%s\t%s\tNO\n'%(QNAME,RNAME,MAPQ,readPos,refPos,eachFlag,refBase.upper(),SEQ[readPos]))
@@ -224,10 +395,956 @@ def generateFlatFile(samFileName,flatFileName,refGenome):
         print('************************************************************************************************************************************\n')
         sys.exit()
 
+#CIGAR operations as encoded by pysam in the cigartuples of each read
+CIGAR_OPS='MIDNSHP=XB'
+
+#expand the CIGAR of one decoded read in one row per position; this is the same interpretation of the CIGAR as in generateFlatFile
+#but it works on the cigartuples of pysam so we do not need to parse any text
+#the reference is taken from the cache once for the whole span of the read
+#every row is (readPos,refPos,cigarFlag,refBase,base,variant) where readPos and refPos are -1 and the bases are '-' if they do not exist
+#a read without SEQ (* in the sam file) keeps its rows with the base '-' and without variants
+#it returns the rows and the number of positions with H and P flags
+def expandRead(read,refCache):
+    rows=[]
+    countH=0
+    countP=0
+    if read.cigartuples is not None:
+        SEQ=read.query_sequence
+        hasSeq=SEQ is not None
+        if not hasSeq:
+            SEQ='-'*read.infer_query_length()
+        readPos=0
+        #pysam gives 0-based coordinates, the flat file keeps the 1-based positions of the sam file
+        refPos=read.reference_start+1
+        #refStart is the 1-based position of the first base in refSeq
+        refStart=refPos
+        refSeq=refCache.fetch(read.reference_name,read.reference_start,read.reference_end)
+        #the reference is shorter than the read if the read goes after the end of the contig, then the reference base is empty
+        if len(refSeq)<read.reference_end-read.reference_start:
+            refSeq=list(refSeq)+['']*(read.reference_end-read.reference_start-len(refSeq))
+        SEQ_UPPER=SEQ.upper()
+        #the rows of every CIGAR operation are built at once for the whole block
+        for eachOp,eachValue in read.cigartuples:
+            eachFlag=CIGAR_OPS[eachOp]
+            if eachFlag=='S' or eachFlag=='I':
+                rows.extend([(idx,-1,eachFlag,'-',base,False) for idx,base in zip(range(readPos,readPos+eachValue),SEQ[readPos:readPos+eachValue])])
+                readPos=readPos+eachValue
+            elif eachFlag=='M' or eachFlag=='=' or eachFlag=='X':
+                offset=refPos-refStart
+                rows.extend([(idx,refIdx,eachFlag,refBase,base,hasSeq and refBase!=baseUpper) for idx,refIdx,refBase,base,baseUpper in
+                             zip(range(readPos,readPos+eachValue),range(refPos,refPos+eachValue),refSeq[offset:offset+eachValue],
+                                 SEQ[readPos:readPos+eachValue],SEQ_UPPER[readPos:readPos+eachValue])])
+                readPos=readPos+eachValue
+                refPos=refPos+eachValue
+            elif eachFlag=='D' or eachFlag=='N':
+                offset=refPos-refStart
+                rows.extend([(-1,idx,eachFlag,refBase,'-',False) for idx,refBase in zip(range(refPos,refPos+eachValue),refSeq[offset:offset+eachValue])])
+                refPos=refPos+eachValue
+            elif eachFlag=='H':
+                countH=countH+eachValue
+            elif eachFlag=='P':
+                countP=countP+eachValue
+    return rows,countH,countP
+
+#the tokens of the MD tag: number of matching bases, deleted reference bases after ^ or one mismatching reference base
+MD_TOKENS=re.compile(r'(\d+)|\^([A-Za-z]+)|([A-Za-z])')
+
+#keep only the rows of a read with a mismatch (VARIANT is YES) or an insertion/deletion
+def variantRows(rows):
+    return [row for row in rows if row[5] or row[2]=='I' or row[2]=='D']
+
+#same as expandRead but it returns only the rows of the mismatches and the insertions/deletions
+#if the read has the MD tag, the mismatches and the deleted bases are taken from MD and CIGAR without the reference genome,
+#so we jump over the matching bases instead of visiting them one by one
+#the reads without MD or SEQ, or with an MD that does not agree with the CIGAR, are expanded with the reference cache
+def expandReadVariants(read,refCache):
+    if read.cigartuples is None or read.query_sequence is None or not read.has_tag('MD'):
+        rows,countH,countP=expandRead(read,refCache)
+        return variantRows(rows),countH,countP
+    rows=[]
+    countH=0
+    countP=0
+    SEQ=read.query_sequence
+    readPos=0
+    refPos=read.reference_start+1
+    mdTokens=MD_TOKENS.findall(read.get_tag('MD'))
+    mdIdx=0
+    #number of matching bases left in the current token of MD
+    mdMatches=0
+    try:
+        for eachOp,eachValue in read.cigartuples:
+            eachFlag=CIGAR_OPS[eachOp]
+            if eachFlag=='M' or eachFlag=='=' or eachFlag=='X':
+                left=eachValue
+                while left>0:
+                    if mdMatches==0:
+                        matches,deleted,refBase=mdTokens[mdIdx]
+                        mdIdx=mdIdx+1
+                        if matches:
+                            mdMatches=int(matches)
+                            continue
+                        if deleted:
+                            raise ValueError('deletion of MD inside an aligned block')
+                        refBase=refBase.upper()
+                        #MD marks N against N as a mismatch, the flat file does not
+                        if refBase!=SEQ[readPos].upper():
+                            rows.append((readPos,refPos,eachFlag,refBase,SEQ[readPos],True))
+                        readPos=readPos+1
+                        refPos=refPos+1
+                        left=left-1
+                    else:
+                        step=min(left,mdMatches)
+                        readPos=readPos+step
+                        refPos=refPos+step
+                        mdMatches=mdMatches-step
+                        left=left-step
+            elif eachFlag=='I':
+                for idx in range(eachValue):
+                    rows.append((readPos,-1,eachFlag,'-',SEQ[readPos],False))
+                    readPos=readPos+1
+            elif eachFlag=='S':
+                readPos=readPos+eachValue
+            elif eachFlag=='D':
+                #skip the zero matches that MD writes before the deletion
+                while mdMatches==0 and mdTokens[mdIdx][0]:
+                    mdMatches=int(mdTokens[mdIdx][0])
+                    mdIdx=mdIdx+1
+                deleted=mdTokens[mdIdx][1]
+                if mdMatches!=0 or len(deleted)!=eachValue:
+                    raise ValueError('deletion of CIGAR not found in MD')
+                mdIdx=mdIdx+1
+                for refBase in deleted.upper():
+                    rows.append((-1,refPos,eachFlag,refBase,'-',False))
+                    refPos=refPos+1
+            elif eachFlag=='N':
+                refPos=refPos+eachValue
+            elif eachFlag=='H':
+                countH=countH+eachValue
+            elif eachFlag=='P':
+                countP=countP+eachValue
+    except (ValueError,IndexError):
+        rows,countH,countP=expandRead(read,refCache)
+        return variantRows(rows),countH,countP
+    return rows,countH,countP
+
+#the text of the positions in the rows of the flat file; -1 is written as '-'
+#the positions in the read are short, so their text is prepared once; the last item of the list is '-' for the index -1
+READ_POS_TEXT=[str(idx) for idx in range(MAX_READ_POS_TEXT)]+['-']
+VARIANT_TEXT=('\tNO\n','\tYES\n')
+VARIANT_QUAL_TEXT=('\tNO\t','\tYES\t')
+#the text of the base qualities; 255 means a missing quality in the bam format, so it is written as '-'
+BASE_QUAL_TEXT=[str(idx) for idx in range(255)]+['-']
+
+#open a text output in binary mode, compressed with bgzip if asked
+def openTextOutput(fileName,compress=False):
+    if compress:
+        return pysam.BGZFile(fileName,'wb')
+    return open(fileName,'wb')
+
+#writes the rows of each read in the TAB limited flat file; every read is followed by an empty line
+#all rows of a read are built at once from the prefix of the read (QNAME, CHROM and MAPQ) and the suffix of each base,
+#and they are kept in a buffer that is written in large blocks
+#with baseQual the base quality of each row is written in one more column
+class FlatTextWriter(object):
+
+    def __init__(self,OutFile,baseQual=False,bufferSize=WRITE_BUFFER):
+        self.OutFile=OutFile
+        self.baseQual=baseQual
+        self.bufferSize=bufferSize
+        self.buffer=[]
+        self.buffered=0
+
+    def write(self,text):
+        self.buffer.append(text)
+        self.buffered=self.buffered+len(text)
+        if self.buffered>=self.bufferSize:
+            self.flush()
+
+    def addRead(self,read,rows):
+        prefix='%s\t%s\t%d\t'%(read.query_name,read.reference_name,read.mapping_quality)
+        if self.baseQual:
+            quals=readQualities(read)
+            text=''.join(['%s%s\t%s\t%s\t%s\t%s%s%s\n'%(prefix,READ_POS_TEXT[readPos] if readPos<MAX_READ_POS_TEXT else readPos,refPos if refPos>=0 else '-',
+                                                         eachFlag,refBase,base,VARIANT_QUAL_TEXT[variant],BASE_QUAL_TEXT[quals[readPos]] if readPos>=0 else '-')
+                          for readPos,refPos,eachFlag,refBase,base,variant in rows])
+        else:
+            text=''.join(['%s%s\t%s\t%s\t%s\t%s%s'%(prefix,READ_POS_TEXT[readPos] if readPos<MAX_READ_POS_TEXT else readPos,refPos if refPos>=0 else '-',
+                                                       eachFlag,refBase,base,VARIANT_TEXT[variant]) for readPos,refPos,eachFlag,refBase,base,variant in rows])
+        self.write(text+'\n')
+
+    def flush(self):
+        if self.buffered>0:
+            self.OutFile.write(''.join(self.buffer).encode('ascii'))
+            self.buffer=[]
+            self.buffered=0
+
+    def close(self):
+        self.flush()
+        self.OutFile.close()
+
+#writes the rows of the flat file in columns; the rows are kept in compact arrays and every rowsPerPart rows
+#they are written as one part file (parquet or npz) in the output folder, so the memory stays bounded
+#QNAME is dictionary-encoded per part, CHROM is encoded with the order of the contigs in the bam header,
+#CIGAR_FLAG, REF and BASE are stored as one ASCII byte, missing positions are -1 and missing bases are '-'
+#with baseQual the column BASE_QUAL has the base quality of each row, 255 for the rows without base
+class FlatColumnarWriter(object):
+
+    def __init__(self,outDir,partPrefix,outputFormat,contigs,baseQual=False,rowsPerPart=ROWS_PER_PART):
+        self.outDir=outDir
+        self.baseQual=baseQual
+        self.partPrefix=partPrefix
+        self.outputFormat=outputFormat
+        self.contigs=list(contigs)
+        self.rowsPerPart=rowsPerPart
+        self.parts=0
+        self.resetColumns()
+
+    def resetColumns(self):
+        self.qnameDict={}
+        self.qnames=[]
+        self.qnameCodes=array.array('i')
+        self.chromCodes=array.array('i')
+        self.mapq=array.array('B')
+        self.readPos=array.array('i')
+        self.refPos=array.array('i')
+        self.cigarFlag=array.array('B')
+        self.refBase=array.array('B')
+        self.base=array.array('B')
+        self.variant=array.array('B')
+        self.qual=array.array('B')
+
+    def addRead(self,read,rows):
+        if len(rows)==0:
+            return
+        qnameCode=self.qnameDict.get(read.query_name)
+        if qnameCode is None:
+            qnameCode=len(self.qnames)
+            self.qnameDict[read.query_name]=qnameCode
+            self.qnames.append(read.query_name)
+        chromCode=read.reference_id
+        mapq=read.mapping_quality
+        for readPos,refPos,eachFlag,refBase,base,variant in rows:
+            self.qnameCodes.append(qnameCode)
+            self.chromCodes.append(chromCode)
+            self.mapq.append(mapq)
+            self.readPos.append(readPos)
+            self.refPos.append(refPos)
+            self.cigarFlag.append(ord(eachFlag))
+            #the reference base is empty if the read goes after the end of the contig
+            self.refBase.append(ord(refBase or '-'))
+            self.base.append(ord(base))
+            self.variant.append(variant)
+        if self.baseQual:
+            quals=readQualities(read)
+            self.qual.extend([quals[readPos] if readPos>=0 else 255 for readPos,refPos,eachFlag,refBase,base,variant in rows])
+        if len(self.readPos)>=self.rowsPerPart:
+            self.flush()
+
+    def flush(self):
+        if len(self.readPos)==0:
+            return
+        partName=os.path.join(self.outDir,'%s_part_%05d'%(self.partPrefix,self.parts))
+        columns=OrderedDict()
+        columns['QNAME']=np.frombuffer(self.qnameCodes,dtype=np.int32)
+        columns['CHROM']=np.frombuffer(self.chromCodes,dtype=np.int32)
+        columns['READ_MAPQ']=np.frombuffer(self.mapq,dtype=np.uint8)
+        columns['READ_POS']=np.frombuffer(self.readPos,dtype=np.int32)
+        columns['REF_POS']=np.frombuffer(self.refPos,dtype=np.int32)
+        columns['CIGAR_FLAG']=np.frombuffer(self.cigarFlag,dtype=np.uint8)
+        columns['REF']=np.frombuffer(self.refBase,dtype=np.uint8)
+        columns['BASE']=np.frombuffer(self.base,dtype=np.uint8)
+        columns['VARIANT']=np.frombuffer(self.variant,dtype=np.uint8).astype(bool)
+        if self.baseQual:
+            columns['BASE_QUAL']=np.frombuffer(self.qual,dtype=np.uint8)
+        if self.outputFormat=='parquet':
+            table=pa.table([pa.DictionaryArray.from_arrays(columns['QNAME'],pa.array(self.qnames)),
+                            pa.DictionaryArray.from_arrays(columns['CHROM'],pa.array(self.contigs))]+
+                           [pa.array(columns[name]) for name in list(columns)[2:]],
+                           names=list(columns))
+            pq.write_table(table,partName+'.parquet')
+        else:
+            np.savez_compressed(partName+'.npz',QNAME_DICT=np.array(self.qnames),CHROM_DICT=np.array(self.contigs),**columns)
+        self.parts=self.parts+1
+        self.resetColumns()
+
+    def close(self):
+        self.flush()
+
+#make the empty folder of the chunk files of an output, removing the chunk files left by a previous run
+def prepareChunkFolder(outputName):
+    chunkDir=outputName+CHUNK_DIR_SUFFIX
+    shutil.rmtree(chunkDir,ignore_errors=True)
+    os.makedirs(chunkDir)
+    return chunkDir
+
+#make the folder of the columnar output and remove the part files of a previous run
+#when a conversion is resumed the part files of the first keepChunks chunks are kept
+def prepareColumnarFolder(outDir,keepChunks=0):
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    for eachFile in os.listdir(outDir):
+        partMatch=re.match(r'chunk_(\d+)_part_\d+\.(parquet|npz)$',eachFile)
+        if partMatch and int(partMatch.group(1))>=keepChunks:
+            os.remove(os.path.join(outDir,eachFile))
+
+#open the writer of the flat output; with txt it is one flat file, otherwise a folder with part files
+#newOutput writes the header of the flat file or prepares the folder; the chunks of generateFlatFileParallel do not need it
+#compress writes the flat file with bgzip
+def openFlatWriter(flatFileName,outputFormat,contigs,partPrefix='chunk_00000',newOutput=True,compress=False,baseQual=False):
+    if outputFormat=='txt':
+        flatWriter=FlatTextWriter(openTextOutput(flatFileName,compress),baseQual)
+        if newOutput:
+            flatWriter.write(flatHeader(baseQual))
+        return flatWriter
+    if newOutput:
+        prepareColumnarFolder(flatFileName)
+    return FlatColumnarWriter(flatFileName,partPrefix,outputFormat,contigs,baseQual)
+
+#the header of the flat file, with the column of the base qualities if asked
+def flatHeader(baseQual=False):
+    if baseQual:
+        return FLAT_HEADER[:-1]+'\tBASE_QUAL\n'
+    return FLAT_HEADER
+
+#the base qualities of a read; if the read has no qualities they are all missing (255)
+def readQualities(read):
+    quals=read.query_qualities
+    if quals is None:
+        #query_length is 0 for a read without SEQ, but its rows have the positions of the CIGAR
+        return [255]*(read.infer_query_length() or 0)
+    return quals
+
+#the reads are filtered with the flags and the mapping quality before any work per base, as samtools view -F and -q do
+#filters is (minMapq,excludeFlags,minBaseQual) or None when there are no filters
+def passReadFilters(read,filters):
+    return read.flag&filters[1]==0 and read.mapping_quality>=filters[0]
+
+#remove the rows of the bases with quality lower than minBaseQual; the rows without base (D and N) are kept
+def filterBaseQual(rows,read,minBaseQual):
+    quals=read.query_qualities
+    if quals is None:
+        return rows
+    return [row for row in rows if row[0]<0 or quals[row[0]]>=minBaseQual]
+
+#stream the alignments directly from the bam file and generate the flat file
+#this avoids the intermediate sam file, so we do not need the extra disk space and we do not parse the CIGAR/SEQ from text
+#with variantsOnly only the rows of mismatches and insertions/deletions are written, and the reads without them are skipped
+#with regions only the reads overlapping the intervals are taken with the index of the bam file and their rows are clipped to the intervals
+#filters are the read and base filters of passReadFilters, and baseQual writes the base quality of each row
+def generateFlatFileFromBam(bamFile,flatFileName,refGenome,refWindow=REF_WINDOW,refCacheSize=REF_CACHE_SIZE,outputFormat='txt',variantsOnly=False,regions=None,compress=False,filters=None,baseQual=False):
+
+    if os.path.exists(bamFile):
+        if os.path.exists(refGenome):
+            countH=0
+            countP=0
+            myFasta=pysam.FastaFile(refGenome)
+            refCache=ReferenceCache(myFasta,refWindow,refCacheSize)
+            myBam=pysam.AlignmentFile(bamFile,'rb')
+            flatWriter=openFlatWriter(flatFileName,outputFormat,myBam.references,compress=compress,baseQual=baseQual)
+            if regions is None:
+                #until_eof gives the reads in the order of the file including the unmapped ones, exactly as pysam.view does
+                countH,countP=writeReads(myBam.fetch(until_eof=True),flatWriter,refCache,variantsOnly,None,filters)
+            else:
+                checkBamIndex(myBam,'generateFlatFileFromBam')
+                chunks,clipIntervals=prepareIntervals(myBam,regions)
+                for contig,start,end,minStart in chunks:
+                    chunkH,chunkP=writeReads(readsOfChunk(myBam,contig,start,end,minStart),flatWriter,refCache,variantsOnly,clipIntervals,filters)
+                    countH=countH+chunkH
+                    countP=countP+chunkP
+            myBam.close()
+            myFasta.close()
+            print('Warning: Found %d positions with CIGAR flag H and %d positions with CIGAR flag P. Please inspect those cases.'%(countH,countP))
+            flatWriter.close()
+        else:
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: generateFlatFileFromBam. The reference genome file does not exist!\n'%(st))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
+    else:
+        ts = time.time()
+        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        print('[%s] ERROR from function: generateFlatFileFromBam. The bam file does not exist!\n'%(st))
+        print('************************************************************************************************************************************\n')
+        sys.exit()
+
+#expand the reads and give their rows to the writer; it returns the number of positions with H and P flags
+#with clipIntervals the rows are clipped to the intervals of the contig, and the reads without rows are skipped as with variantsOnly
+#with filters the reads that do not pass them are skipped before the CIGAR is expanded
+def writeReads(reads,flatWriter,refCache,variantsOnly=False,clipIntervals=None,filters=None):
+    countH=0
+    countP=0
+    if variantsOnly:
+        expandFunction=expandReadVariants
+    else:
+        expandFunction=expandRead
+    skipEmpty=variantsOnly or clipIntervals is not None or filters is not None
+    for read in reads:
+        if filters is not None and not passReadFilters(read,filters):
+            continue
+        rows,readH,readP=expandFunction(read,refCache)
+        if filters is not None and filters[2]>0:
+            rows=filterBaseQual(rows,read,filters[2])
+        if clipIntervals is not None:
+            rows=clipRows(rows,read.reference_start,clipIntervals[read.reference_name])
+        if len(rows)>0 or not skipEmpty:
+            flatWriter.addRead(read,rows)
+        countH=countH+readH
+        countP=countP+readP
+    return countH,countP
+
+#the reads of one chunk of the genome or of one interval; the reads that start before minStart are left to the previous chunk
+#the chunk of contig '*' holds the unmapped reads without coordinates
+def readsOfChunk(myBam,contig,start,end,minStart):
+    if contig=='*':
+        for read in myBam.fetch('*'):
+            yield read
+    else:
+        for read in myBam.fetch(contig,start,end):
+            if read.reference_start>=minStart:
+                yield read
+
+#keep the rows of a read with a reference position inside the intervals (starts,ends) of its contig
+#the rows without reference position (S and I) are kept if the next reference position of the read is inside
+def clipRows(rows,readStart,intervals):
+    starts,ends=intervals
+    clipped=[]
+    #1-based position of the last reference base we have seen
+    lastRef=readStart
+    for row in rows:
+        if row[1]>=0:
+            lastRef=row[1]
+            position=row[1]
+        else:
+            position=lastRef+1
+        idx=bisect.bisect_right(starts,position-1)-1
+        if idx>=0 and position<=ends[idx]:
+            clipped.append(row)
+    return clipped
+
+#check that the bam file has an index, we need it for the regions and the parallel chunks
+def checkBamIndex(myBam,functionName):
+    if not myBam.has_index():
+        ts = time.time()
+        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        print('[%s] ERROR from function: %s. The bam file is not indexed!\n'%(st,functionName))
+        print('************************************************************************************************************************************\n')
+        sys.exit()
+
+#parse a region in the format chrom:start-end or chrom:start (1-based like samtools) or only chrom for the whole contig
+#it returns the region as (chrom,start,end) with 0-based start; end is None up to the end of the contig
+def parseRegion(region):
+    tmp=region.rsplit(':',1)
+    if len(tmp)==2 and re.match(r'^[\d,]+(-[\d,]*)?$',tmp[1]):
+        positions=tmp[1].replace(',','').split('-')
+        endPos=None
+        if len(positions)>1 and positions[1]!='':
+            endPos=int(positions[1])
+        return (tmp[0],int(positions[0])-1,endPos)
+    return (region,0,None)
+
+#read the intervals of a bed file; the first three columns are chrom, start (0-based) and end
+def readBedFile(bedFile):
+    regions=[]
+    if os.path.exists(bedFile):
+        InBedFile=open(bedFile,'r')
+        for eachLine in InBedFile:
+            line=eachLine.rstrip('\n')
+            if line=='' or line.startswith('#') or line.startswith('track') or line.startswith('browser'):
+                continue
+            tmp=line.split('\t')
+            regions.append((tmp[0],int(tmp[1]),int(tmp[2])))
+        InBedFile.close()
+    else:
+        ts = time.time()
+        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        print('[%s] ERROR from function: readBedFile. The bed file does not exist!\n'%(st))
+        print('************************************************************************************************************************************\n')
+        sys.exit()
+    return regions
+
+#sort and merge the overlapping intervals in the order of the contigs of the bam header
+#it returns the chunks (contig,start,end,minStart) to fetch, where minStart is the end of the previous interval of the contig
+#so a read spanning several intervals is written only once, and for each contig the merged intervals as lists of starts and ends
+def prepareIntervals(myBam,regions):
+    byContig=defaultdict(list)
+    for contig,start,end in regions:
+        if contig not in myBam.references:
+            print('Warning: The contig %s of the regions is not in the bam file and it is skipped.'%contig)
+            continue
+        if end is None:
+            end=myBam.get_reference_length(contig)
+        byContig[contig].append((max(start,0),end))
+    chunks=[]
+    clipIntervals={}
+    for contig in myBam.references:
+        if contig not in byContig:
+            continue
+        merged=[]
+        for start,end in sorted(byContig[contig]):
+            if len(merged)>0 and start<=merged[-1][1]:
+                merged[-1][1]=max(merged[-1][1],end)
+            else:
+                merged.append([start,end])
+        minStart=0
+        for start,end in merged:
+            chunks.append((contig,start,end,minStart))
+            minStart=end
+        clipIntervals[contig]=([start for start,end in merged],[end for start,end in merged])
+    return chunks,clipIntervals
+
+#split the genome in chunks using the contigs of the bam header, which is also the order of a sorted bam file
+#if chunkSize is 0 every contig is one chunk, otherwise the contigs are split in fixed-size intervals
+#the last chunk holds the unmapped reads without coordinates that are found at the end of the bam file
+def splitGenomeChunks(myBam,chunkSize):
+    chunks=[]
+    for contig,contigLen in zip(myBam.references,myBam.lengths):
+        if chunkSize>0:
+            for start in range(0,contigLen,chunkSize):
+                chunks.append((contig,start,min(start+chunkSize,contigLen),start))
+        else:
+            chunks.append((contig,0,contigLen,0))
+    chunks.append(('*',0,0,0))
+    return chunks
+
+#every worker process opens its own bam file and reference genome once and keeps them for all chunks it processes
+def initChunkWorker(bamFile,refGenome,refWindow,refCacheSize,outputFormat,variantsOnly,clipIntervals,filters,baseQual,compress=False):
+    global workerBam,workerCache,workerFormat,workerVariantsOnly,workerClipIntervals,workerFilters,workerBaseQual,workerCompress
+    workerBam=pysam.AlignmentFile(bamFile,'rb')
+    workerCache=ReferenceCache(pysam.FastaFile(refGenome),refWindow,refCacheSize)
+    workerFormat=outputFormat
+    workerVariantsOnly=variantsOnly
+    workerClipIntervals=clipIntervals
+    workerFilters=filters
+    workerBaseQual=baseQual
+    workerCompress=compress
+
+#write the flat rows of one chunk in its own file, or in its own part files for the columnar formats
+#a read belongs to the chunk where it starts, so the reads overlapping the chunk start are left to the previous chunk
+#with compress the chunk file is already compressed with bgzip; bgzip files can be concatenated as they are
+def processChunk(chunkArgs):
+    contig,start,end,minStart,chunkFileName,partPrefix=chunkArgs
+    flatWriter=openFlatWriter(chunkFileName,workerFormat,workerBam.references,partPrefix,False,workerCompress,workerBaseQual)
+    countH,countP=writeReads(readsOfChunk(workerBam,contig,start,end,minStart),flatWriter,workerCache,workerVariantsOnly,workerClipIntervals,workerFilters)
+    flatWriter.close()
+    return chunkFileName,countH,countP
+
+#write the checkpoint of a conversion: the settings of the run, the number of complete chunks and the last of them,
+#the size in bytes of the output up to it and the counts of H and P so far
+#the checkpoint is written in a new file that replaces the old one, so a crash while writing it keeps the previous checkpoint
+def writeCheckpoint(checkpointFile,settings,chunksDone,lastChunk,outputOffset,countH,countP):
+    OutFile=open(checkpointFile+'.tmp','w')
+    OutFile.write('SETTINGS\t%s\n'%settings)
+    OutFile.write('CHUNKS_DONE\t%d\n'%chunksDone)
+    OutFile.write('LAST_CHUNK\t%s:%d-%d\n'%lastChunk)
+    OutFile.write('OUTPUT_OFFSET\t%d\n'%outputOffset)
+    OutFile.write('COUNT_H\t%d\n'%countH)
+    OutFile.write('COUNT_P\t%d\n'%countP)
+    OutFile.flush()
+    os.fsync(OutFile.fileno())
+    OutFile.close()
+    os.rename(checkpointFile+'.tmp',checkpointFile)
+
+#read the checkpoint of a conversion that stopped; it has to come from a run with the same settings
+def readCheckpoint(checkpointFile,settings):
+    values={}
+    InFile=open(checkpointFile,'r')
+    for line in InFile:
+        tmp=line.rstrip('\n').split('\t',1)
+        if len(tmp)==2:
+            values[tmp[0]]=tmp[1]
+    InFile.close()
+    if values.get('SETTINGS')!=settings:
+        ts = time.time()
+        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        print('[%s] ERROR from function: readCheckpoint. The checkpoint %s comes from a run with different arguments or a different bam file!\n'%(st,checkpointFile))
+        print('************************************************************************************************************************************\n')
+        sys.exit()
+    return int(values['CHUNKS_DONE']),values['LAST_CHUNK'],int(values['OUTPUT_OFFSET']),int(values['COUNT_H']),int(values['COUNT_P'])
+
+#generate the flat file chunk by chunk, one chunk of the genome (or one interval of the regions) per task
+#with more than one thread the chunks are processed by a pool of worker processes, otherwise in this process
+#the chunk files are concatenated in reference order so the output is the same as the one of generateFlatFileFromBam
+#with the columnar formats every chunk writes its own part files, named in reference order, in the output folder
+#checkpointSettings (a text with the arguments of the run) writes a checkpoint at most every checkpointInterval seconds;
+#with resume the conversion continues from the checkpoint of a previous run with the same settings
+def generateFlatFileParallel(bamFile,flatFileName,refGenome,threads,chunkSize=0,refWindow=REF_WINDOW,refCacheSize=REF_CACHE_SIZE,outputFormat='txt',variantsOnly=False,regions=None,compress=False,filters=None,baseQual=False,checkpointSettings=None,checkpointInterval=0,resume=False):
+
+    if os.path.exists(bamFile):
+        if os.path.exists(refGenome):
+            myBam=pysam.AlignmentFile(bamFile,'rb')
+            checkBamIndex(myBam,'generateFlatFileParallel')
+            if regions is None:
+                chunks=splitGenomeChunks(myBam,chunkSize)
+                clipIntervals=None
+            else:
+                chunks,clipIntervals=prepareIntervals(myBam,regions)
+            myBam.close()
+            checkpointFile=flatFileName+'.checkpoint'
+            chunksDone=0
+            outputOffset=0
+            countH=0
+            countP=0
+            if resume and os.path.exists(checkpointFile):
+                chunksDone,lastChunk,outputOffset,countH,countP=readCheckpoint(checkpointFile,checkpointSettings)
+                if not os.path.exists(flatFileName) or (outputFormat=='txt' and os.path.getsize(flatFileName)<outputOffset):
+                    ts = time.time()
+                    st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+                    print('[%s] ERROR from function: generateFlatFileParallel. The output %s is missing or shorter than in its checkpoint!\n'%(st,flatFileName))
+                    print('************************************************************************************************************************************\n')
+                    sys.exit()
+                print('Resume after chunk %d of %d (%s)'%(chunksDone,len(chunks),lastChunk))
+            else:
+                if resume:
+                    print('Warning: There is no checkpoint %s. The conversion starts from the beginning.'%checkpointFile)
+                #a checkpoint of an older run does not match the new output
+                if os.path.exists(checkpointFile):
+                    os.remove(checkpointFile)
+            chunkDir=None
+            if outputFormat=='txt':
+                #the chunk files are written next to the flat file, in a folder named after it, so the folder of a run
+                #that was killed is cleared by the next run or resume of the same output
+                chunkDir=prepareChunkFolder(flatFileName)
+            tasks=[]
+            for idx,(contig,start,end,minStart) in enumerate(chunks):
+                if idx<chunksDone:
+                    continue
+                if outputFormat=='txt':
+                    tasks.append((contig,start,end,minStart,os.path.join(chunkDir,'chunk_%d.txt'%idx),None))
+                else:
+                    tasks.append((contig,start,end,minStart,flatFileName,'chunk_%05d'%idx))
+            if outputFormat=='txt':
+                if chunksDone==0:
+                    HeaderFile=openTextOutput(flatFileName,compress)
+                    HeaderFile.write(flatHeader(baseQual).encode('ascii'))
+                    HeaderFile.close()
+                #the chunk files are appended as they are, so the flat file is opened without compression
+                OutFile=open(flatFileName,'r+b')
+                if chunksDone>0:
+                    OutFile.truncate(outputOffset)
+                OutFile.seek(0,2)
+            else:
+                prepareColumnarFolder(flatFileName,chunksDone)
+            #the chunk files that are not merged yet are removed with their folder, also after an error or an interruption
+            myPool=None
+            try:
+                workerArgs=(bamFile,refGenome,refWindow,refCacheSize,outputFormat,variantsOnly,clipIntervals,filters,baseQual,compress)
+                if threads>1:
+                    myPool=multiprocessing.Pool(threads,initChunkWorker,workerArgs)
+                    #imap returns the chunks in the order we gave them, so we append each one as soon as it is ready
+                    results=myPool.imap(processChunk,tasks)
+                else:
+                    initChunkWorker(*workerArgs)
+                    results=(processChunk(eachTask) for eachTask in tasks)
+                lastCheckpoint=time.time()
+                for chunkFileName,chunkH,chunkP in results:
+                    if outputFormat=='txt':
+                        InChunkFile=open(chunkFileName,'rb')
+                        shutil.copyfileobj(InChunkFile,OutFile,WRITE_BUFFER)
+                        InChunkFile.close()
+                        os.remove(chunkFileName)
+                    countH=countH+chunkH
+                    countP=countP+chunkP
+                    chunksDone=chunksDone+1
+                    if checkpointSettings is not None and time.time()-lastCheckpoint>=checkpointInterval:
+                        #the checkpoint is written only when the output up to this chunk is on the disk
+                        if outputFormat=='txt':
+                            OutFile.flush()
+                            os.fsync(OutFile.fileno())
+                            outputOffset=OutFile.tell()
+                        writeCheckpoint(checkpointFile,checkpointSettings,chunksDone,chunks[chunksDone-1][:3],outputOffset,countH,countP)
+                        lastCheckpoint=time.time()
+                if threads>1:
+                    myPool.close()
+                    myPool.join()
+            finally:
+                if myPool is not None:
+                    myPool.terminate()
+                if chunkDir is not None:
+                    shutil.rmtree(chunkDir,ignore_errors=True)
+            if outputFormat=='txt':
+                OutFile.close()
+            if os.path.exists(checkpointFile):
+                os.remove(checkpointFile)
+            print('Warning: Found %d positions with CIGAR flag H and %d positions with CIGAR flag P. Please inspect those cases.'%(countH,countP))
+        else:
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: generateFlatFileParallel. The reference genome file does not exist!\n'%(st))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
+    else:
+        ts = time.time()
+        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        print('[%s] ERROR from function: generateFlatFileParallel. The bam file does not exist!\n'%(st))
+        print('************************************************************************************************************************************\n')
+        sys.exit()
+
+#codes of the bases in the count arrays of the aggregate mode; every other base is counted as N
+BASE_CODES=None
+if np is not None:
+    BASE_CODES=np.full(256,4,dtype=np.int8)
+    for idx,eachBase in enumerate('ACGT'):
+        BASE_CODES[ord(eachBase)]=idx
+        BASE_CODES[ord(eachBase.lower())]=idx
+
+#counts per reference position the bases, insertions and deletions of the reads and the mismatches by MAPQ bin
+#the counts are kept in numpy arrays indexed by the offset of the position in a window of the contig
+#the reads come sorted from the index, so when a read goes after the end of the window the positions before its start
+#are final; they are written and the window moves forward, so the memory depends on the window and not on the genome
+#only the positions in [start,end) are counted, so a read overlapping two chunks is counted once in each for its own positions
+class PileupCounter(object):
+
+    def __init__(self,OutFile,refCache,contig,start,end,windowSize=PILEUP_WINDOW,minBaseQual=0):
+        self.OutFile=OutFile
+        self.minBaseQual=minBaseQual
+        self.refCache=refCache
+        self.contig=contig
+        self.start=start
+        self.end=end
+        self.size=max(1,min(windowSize,end-start))
+        self.allocate(start)
+
+    #make empty arrays for the window that starts at windowStart and load its reference bases
+    def allocate(self,windowStart):
+        self.windowStart=windowStart
+        self.baseCounts=np.zeros((5,self.size),dtype=np.int32)
+        self.insCounts=np.zeros(self.size,dtype=np.int32)
+        self.delCounts=np.zeros(self.size,dtype=np.int32)
+        self.binBases=np.zeros((len(MAPQ_BINS),self.size),dtype=np.int32)
+        self.binMismatches=np.zeros((len(MAPQ_BINS),self.size),dtype=np.int32)
+        self.loadReference()
+
+    def loadReference(self):
+        refSeq=self.refCache.fetch(self.contig,self.windowStart,self.windowStart+self.size)
+        self.refSeq=refSeq+'N'*(self.size-len(refSeq))
+        self.refCodes=BASE_CODES[np.frombuffer(self.refSeq.encode('ascii'),dtype=np.uint8)]
+
+    #a read without SEQ (* in the sam file, e.g. a secondary alignment written without its bases) has no bases to count
+    #and is skipped
+    def addRead(self,read):
+        if read.cigartuples is None or read.query_sequence is None:
+            return
+        readEnd=min(read.reference_end,self.end)
+        if readEnd>self.windowStart+self.size:
+            self.moveWindow(max(read.reference_start,self.start),readEnd)
+        mapqBin=bisect.bisect_right(MAPQ_BINS,read.mapping_quality)-1
+        seqCodes=BASE_CODES[np.frombuffer(read.query_sequence.encode('ascii'),dtype=np.uint8)]
+        #the bases with low quality are not counted
+        quals=None
+        if self.minBaseQual>0 and read.query_qualities is not None:
+            quals=np.frombuffer(read.query_qualities,dtype=np.uint8)
+        readPos=0
+        refPos=read.reference_start
+        for eachOp,eachValue in read.cigartuples:
+            eachFlag=CIGAR_OPS[eachOp]
+            if eachFlag=='M' or eachFlag=='=' or eachFlag=='X':
+                #clip the aligned block to the positions of the chunk
+                blockStart=max(refPos,self.start)
+                blockEnd=min(refPos+eachValue,self.end)
+                if blockStart<blockEnd:
+                    first=blockStart-self.windowStart
+                    last=blockEnd-self.windowStart
+                    codes=seqCodes[readPos+blockStart-refPos:readPos+blockEnd-refPos]
+                    if quals is None:
+                        self.baseCounts[codes,np.arange(first,last)]+=1
+                        self.binBases[mapqBin,first:last]+=1
+                        self.binMismatches[mapqBin,first:last]+=(codes!=self.refCodes[first:last])
+                    else:
+                        keep=quals[readPos+blockStart-refPos:readPos+blockEnd-refPos]>=self.minBaseQual
+                        offsets=np.arange(first,last)[keep]
+                        codes=codes[keep]
+                        self.baseCounts[codes,offsets]+=1
+                        self.binBases[mapqBin,offsets]+=1
+                        self.binMismatches[mapqBin,offsets]+=(codes!=self.refCodes[offsets])
+                readPos=readPos+eachValue
+                refPos=refPos+eachValue
+            elif eachFlag=='D':
+                blockStart=max(refPos,self.start)
+                blockEnd=min(refPos+eachValue,self.end)
+                if blockStart<blockEnd:
+                    self.delCounts[blockStart-self.windowStart:blockEnd-self.windowStart]+=1
+                refPos=refPos+eachValue
+            elif eachFlag=='N':
+                refPos=refPos+eachValue
+            elif eachFlag=='I':
+                #one insertion is counted at the reference position before it, as samtools does
+                if refPos>read.reference_start and self.start<=refPos-1<self.end and refPos-1>=self.windowStart:
+                    self.insCounts[refPos-1-self.windowStart]+=1
+                readPos=readPos+eachValue
+            elif eachFlag=='S':
+                readPos=readPos+eachValue
+
+    #write the positions before newStart and move the window to start there; the window grows if a read is longer than it
+    def moveWindow(self,newStart,readEnd):
+        self.flush(newStart)
+        shift=newStart-self.windowStart
+        keep=self.size-shift
+        newSize=max(self.size,readEnd-newStart)
+        for name in ['baseCounts','insCounts','delCounts','binBases','binMismatches']:
+            counts=getattr(self,name)
+            moved=np.zeros(counts.shape[:-1]+(newSize,),dtype=np.int32)
+            if keep>0:
+                moved[...,:keep]=counts[...,shift:]
+            setattr(self,name,moved)
+        self.size=newSize
+        self.windowStart=newStart
+        self.loadReference()
+
+    #write the covered positions of the window before upTo
+    def flush(self,upTo):
+        last=min(upTo-self.windowStart,self.size)
+        if last<=0:
+            return
+        depth=self.baseCounts[:,:last].sum(axis=0)
+        covered=np.nonzero(depth+self.insCounts[:last]+self.delCounts[:last])[0]
+        baseCounts=self.baseCounts[:,covered].T.tolist()
+        insCounts=self.insCounts[covered].tolist()
+        delCounts=self.delCounts[covered].tolist()
+        binBases=self.binBases[:,covered].T.tolist()
+        binMismatches=self.binMismatches[:,covered].T.tolist()
+        depth=depth[covered].tolist()
+        for idx,offset in enumerate(covered.tolist()):
+            rates=[]
+            for bases,mismatches in zip(binBases[idx],binMismatches[idx]):
+                if bases>0:
+                    rates.append('%.4f'%(float(mismatches)/bases))
+                else:
+                    rates.append('NA')
+            self.OutFile.write('%s\t%d\t%s\t%d\t%s\t%d\t%d\t%s\n'%(self.contig,self.windowStart+offset+1,self.refSeq[offset],depth[idx],
+                               '\t'.join([str(count) for count in baseCounts[idx]]),insCounts[idx],delCounts[idx],'\t'.join(rates)))
+
+    def close(self):
+        self.flush(self.windowStart+self.size)
+
+#the header of the aggregate output with one column of mismatch rate per MAPQ bin
+def pileupHeader():
+    binNames=[]
+    for idx,low in enumerate(MAPQ_BINS):
+        if idx+1<len(MAPQ_BINS):
+            binNames.append('MISMATCH_RATE_MAPQ_%d_%d'%(low,MAPQ_BINS[idx+1]-1))
+        else:
+            binNames.append('MISMATCH_RATE_MAPQ_%d_PLUS'%low)
+    return '#CHROM\tPOS\tREF\tDEPTH\tA\tC\tG\tT\tN\tINS\tDEL\t%s\n'%('\t'.join(binNames))
+
+#count the reads of one chunk (or one interval) and write its positions in OutFile
+def aggregateChunk(myBam,refCache,contig,start,end,OutFile,pileupWindow,filters=None):
+    if filters is None:
+        counter=PileupCounter(OutFile,refCache,contig,start,end,pileupWindow)
+    else:
+        counter=PileupCounter(OutFile,refCache,contig,start,end,pileupWindow,filters[2])
+    for read in myBam.fetch(contig,start,end):
+        if filters is None or passReadFilters(read,filters):
+            counter.addRead(read)
+    counter.close()
+
+#every worker of the aggregate mode writes the positions of its chunk in its own file
+def initPileupWorker(bamFile,refGenome,refWindow,refCacheSize,pileupWindow,filters):
+    global workerBam,workerCache,workerPileupWindow,workerFilters
+    workerBam=pysam.AlignmentFile(bamFile,'rb')
+    workerCache=ReferenceCache(pysam.FastaFile(refGenome),refWindow,refCacheSize)
+    workerPileupWindow=pileupWindow
+    workerFilters=filters
+
+def processPileupChunk(chunkArgs):
+    contig,start,end,chunkFileName=chunkArgs
+    OutFile=open(chunkFileName,'w')
+    aggregateChunk(workerBam,workerCache,contig,start,end,OutFile,workerPileupWindow,workerFilters)
+    OutFile.close()
+    return chunkFileName
+
+#aggregate mode: instead of one row per base of every read, write per reference position the counts of the bases,
+#the insertions and deletions and the mismatch rate by MAPQ bin, in one streaming pass over the sorted and indexed bam file
+#the chunks are the contigs (or the intervals of the regions); with threads they are processed in parallel and merged in order
+def generatePileupFile(bamFile,pileupFileName,refGenome,threads=1,chunkSize=0,refWindow=REF_WINDOW,refCacheSize=REF_CACHE_SIZE,regions=None,pileupWindow=PILEUP_WINDOW,filters=None):
+
+    if os.path.exists(bamFile):
+        if os.path.exists(refGenome):
+            myBam=pysam.AlignmentFile(bamFile,'rb')
+            checkBamIndex(myBam,'generatePileupFile')
+            if regions is None:
+                #the unmapped reads without coordinates are not needed
+                chunks=splitGenomeChunks(myBam,chunkSize)[:-1]
+            else:
+                chunks=prepareIntervals(myBam,regions)[0]
+            OutFile=open(pileupFileName,'w')
+            OutFile.write(pileupHeader())
+            if threads>1:
+                myBam.close()
+                chunkDir=prepareChunkFolder(pileupFileName)
+                #the chunk files that are not merged yet are removed with their folder, also after an error or an interruption
+                myPool=None
+                try:
+                    tasks=[]
+                    for idx,(contig,start,end,minStart) in enumerate(chunks):
+                        tasks.append((contig,start,end,os.path.join(chunkDir,'chunk_%d.txt'%idx)))
+                    myPool=multiprocessing.Pool(threads,initPileupWorker,(bamFile,refGenome,refWindow,refCacheSize,pileupWindow,filters))
+                    for chunkFileName in myPool.imap(processPileupChunk,tasks):
+                        InChunkFile=open(chunkFileName,'r')
+                        shutil.copyfileobj(InChunkFile,OutFile)
+                        InChunkFile.close()
+                        os.remove(chunkFileName)
+                    myPool.close()
+                    myPool.join()
+                finally:
+                    if myPool is not None:
+                        myPool.terminate()
+                    shutil.rmtree(chunkDir,ignore_errors=True)
+            else:
+                myFasta=pysam.FastaFile(refGenome)
+                refCache=ReferenceCache(myFasta,refWindow,refCacheSize)
+                for contig,start,end,minStart in chunks:
+                    aggregateChunk(myBam,refCache,contig,start,end,OutFile,pileupWindow,filters)
+                myBam.close()
+                myFasta.close()
+            OutFile.close()
+        else:
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: generatePileupFile. The reference genome file does not exist!\n'%(st))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
+    else:
+        ts = time.time()
+        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        print('[%s] ERROR from function: generatePileupFile. The bam file does not exist!\n'%(st))
+        print('************************************************************************************************************************************\n')
+        sys.exit()
+
+#the columnar output is written as parquet if pyarrow is installed, otherwise as npz files of numpy
+def resolveOutputFormat(outputFormat):
+    if outputFormat=='columnar':
+        if pq is not None:
+            outputFormat='parquet'
+        else:
+            outputFormat='npz'
+    if outputFormat not in ['txt','parquet','npz'] or (outputFormat=='parquet' and pq is None) or (outputFormat=='npz' and np is None):
+        ts = time.time()
+        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        print('[%s] ERROR from function: resolveOutputFormat. The output format %s is not known or the python modules it needs (numpy/pyarrow) are not installed!\n'%(st,outputFormat))
+        print('************************************************************************************************************************************\n')
+        sys.exit()
+    return outputFormat
+
+#parse the optional arguments given after the mandatory ones; all of them are in the format name=value
+def parseOptionalArgs(argList):
+    options={}
+    for eachArg in argList:
+        tmp=eachArg.split('=',1)
+        if len(tmp)!=2 or tmp[0] not in OPTIONAL_ARGS:
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: parseOptionalArgs. The argument %s is not recognised!\n'%(st,eachArg))
+            print('************************************************************************************************************************************\n')
+            printUsage()
+            sys.exit()
+        options[tmp[0]]=tmp[1]
+    return options
+
 #main function of the program
 def myMain():
     #check the number of input arguments
-    if len(sys.argv)!=3:
+    if len(sys.argv)<3:
         print('************************************************************************************************************************************\n')
         print('\t\t\t\t\tYour input arguments are not correct!\n')
         print('\t\t\t\t\t\tCEC Bioinformatics Team\n')
@@ -245,28 +1362,132 @@ def myMain():
         #parse the second argument
         refGenome=sys.argv[2].split('referenceGenome=')
         refGenome=refGenome[1]
+        #parse the optional arguments
+        options=parseOptionalArgs(sys.argv[3:])
+        writeSam=options.get('writeSam','no')
+        refWindow=int(options.get('refWindow',REF_WINDOW))
+        refCacheSize=int(options.get('refCacheSize',REF_CACHE_SIZE))
+        threads=int(options.get('threads',1))
+        chunkSize=int(options.get('chunkSize',0))
+        outputFormat=resolveOutputFormat(options.get('outputFormat','txt'))
+        variantsOnly=options.get('variantsOnly','no')
+        region=options.get('region','-')
+        bedFile=options.get('bedFile','-')
+        regions=None
+        if region!='-' or bedFile!='-':
+            regions=[]
+            if region!='-':
+                regions.append(parseRegion(region))
+            if bedFile!='-':
+                regions.extend(readBedFile(bedFile))
+        aggregate=options.get('aggregate','no')
+        pileupWindow=int(options.get('pileupWindow',PILEUP_WINDOW))
+        compress=options.get('compress','no')
+        minMapq=int(options.get('minMapq',0))
+        #the flags can be given in decimal or in hexadecimal like in samtools
+        excludeFlags=int(options.get('excludeFlags','0'),0)
+        primaryOnly=options.get('primaryOnly','no')
+        if primaryOnly=='yes':
+            excludeFlags=excludeFlags|0x900
+        minBaseQual=int(options.get('minBaseQual',0))
+        baseQual=options.get('baseQual','no')
+        checkpoint=int(options.get('checkpoint',0))
+        resume=options.get('resume','no')
+        if resume=='yes' and checkpoint==0:
+            checkpoint=60
+        filters=None
+        if minMapq>0 or excludeFlags>0 or minBaseQual>0:
+            filters=(minMapq,excludeFlags,minBaseQual)
+        if writeSam=='yes' and (outputFormat!='txt' or variantsOnly=='yes' or regions is not None or aggregate=='yes' or filters is not None or baseQual=='yes'):
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: myMain. The columnar output, variantsOnly, region, bedFile, aggregate and the filters are not available with writeSam=yes!\n'%(st))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
+        if checkpoint>0 and (writeSam=='yes' or aggregate=='yes'):
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('[%s] ERROR from function: myMain. The checkpoints are available only for the flat file, not with writeSam=yes or aggregate=yes!\n'%(st))
+            print('************************************************************************************************************************************\n')
+            sys.exit()
         #print the arguments given by user; is good for 'self' debugging
         print('Execution started with the following parameters:\n')
         print('1. bamFile         :         \t\t\t\t%s' % bamFile)
         print('2. referenceGenome :         \t\t\t\t%s' % refGenome)
-        
-        #generate the sam file
-        ts = time.time()
-        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-        print('\n[%s] Function generateSamFile: produce SAM file'%(st))
+        print('3. writeSam        :         \t\t\t\t%s' % writeSam)
+        print('4. refWindow       :         \t\t\t\t%d' % refWindow)
+        print('5. refCacheSize    :         \t\t\t\t%d' % refCacheSize)
+        print('6. threads         :         \t\t\t\t%d' % threads)
+        print('7. chunkSize       :         \t\t\t\t%d' % chunkSize)
+        print('8. outputFormat    :         \t\t\t\t%s' % outputFormat)
+        print('9. variantsOnly    :         \t\t\t\t%s' % variantsOnly)
+        print('10. region         :         \t\t\t\t%s' % region)
+        print('11. bedFile        :         \t\t\t\t%s' % bedFile)
+        print('12. aggregate      :         \t\t\t\t%s' % aggregate)
+        print('13. pileupWindow   :         \t\t\t\t%d' % pileupWindow)
+        print('14. compress       :         \t\t\t\t%s' % compress)
+        print('15. minMapq        :         \t\t\t\t%d' % minMapq)
+        print('16. excludeFlags   :         \t\t\t\t%d' % excludeFlags)
+        print('17. minBaseQual    :         \t\t\t\t%d' % minBaseQual)
+        print('18. baseQual       :         \t\t\t\t%s' % baseQual)
+        print('19. checkpoint     :         \t\t\t\t%d' % checkpoint)
+        print('20. resume         :         \t\t\t\t%s' % resume)
+
         #save the bam file prefix for further naming of files
         bamFilePrefix=bamFile[:-4]
-        #use the prefix to generate the sam file name
-        samFileName=bamFilePrefix+'.sam'
-        generateSamFile(bamFile,samFileName)
+        #use the prefix name to generate the file name for the flat file, or the folder name for the columnar output
+        if outputFormat=='txt':
+            flatFileName=bamFilePrefix+'_flat.txt'
+            if compress=='bgzip':
+                flatFileName=flatFileName+'.gz'
+        else:
+            flatFileName=bamFilePrefix+'_flat_'+outputFormat
+        if aggregate=='yes':
+            if np is None:
+                ts = time.time()
+                st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+                print('[%s] ERROR from function: myMain. The aggregate mode needs numpy!\n'%(st))
+                print('************************************************************************************************************************************\n')
+                sys.exit()
+            #count the bases per reference position instead of writing the flat file
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('\n[%s] Function generatePileupFile: produce per-position counts'%(st))
+            generatePileupFile(bamFile,bamFilePrefix+'_pileup.txt',refGenome,threads,chunkSize,refWindow,refCacheSize,regions,pileupWindow,filters)
+        elif writeSam=='yes':
+            #generate the sam file
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('\n[%s] Function generateSamFile: produce SAM file'%(st))
+            #use the prefix to generate the sam file name
+            samFileName=bamFilePrefix+'.sam'
+            generateSamFile(bamFile,samFileName)
 
-        #parse the sam file and produce the flat file
-        ts = time.time()
-        st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-        print('\n[%s] Function generateFlatFile: produce flat file'%(st))
-        #use the previous prefix name to generate the file name for the flat file
-        flatFileName=bamFilePrefix+'_flat.txt'
-        generateFlatFile(samFileName,flatFileName,refGenome)
+            #parse the sam file and produce the flat file
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('\n[%s] Function generateFlatFile: produce flat file'%(st))
+            generateFlatFile(samFileName,flatFileName,refGenome,refWindow,refCacheSize)
+        elif threads>1 or checkpoint>0:
+            #process the chunks of the genome in parallel and merge them in the flat file
+            checkpointSettings=None
+            if checkpoint>0:
+                if chunkSize==0:
+                    chunkSize=CHECKPOINT_CHUNK
+                #a checkpoint is used only by a run with the same arguments (except threads) on the same bam file
+                checkpointSettings=' '.join(sys.argv[1:3]+sorted([name+'='+value for name,value in options.items() if name not in ['threads','checkpoint','resume']]))
+                if os.path.exists(bamFile):
+                    checkpointSettings=checkpointSettings+' bamSize=%d bamTime=%d'%(os.path.getsize(bamFile),os.path.getmtime(bamFile))
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('\n[%s] Function generateFlatFileParallel: produce flat file with %d processes'%(st,threads))
+            generateFlatFileParallel(bamFile,flatFileName,refGenome,threads,chunkSize,refWindow,refCacheSize,outputFormat,variantsOnly=='yes',regions,compress=='bgzip',filters,baseQual=='yes',checkpointSettings,checkpoint,resume=='yes')
+        else:
+            #stream the reads from the bam file and produce the flat file
+            ts = time.time()
+            st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+            print('\n[%s] Function generateFlatFileFromBam: produce flat file'%(st))
+            generateFlatFileFromBam(bamFile,flatFileName,refGenome,refWindow,refCacheSize,outputFormat,variantsOnly=='yes',regions,compress=='bgzip',filters,baseQual=='yes')
         
 #this is where we start
 if __name__=='__main__':
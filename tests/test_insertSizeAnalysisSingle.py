@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pysam
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import insertSizeAnalysisSingle as isa
+
+NUM_BLOCKS=20
+PAIRS_PER_BLOCK=500
+
+#one contig of NUM_BLOCKS sample blocks with PAIRS_PER_BLOCK pairs in every block; the TLEN of a pair is 200 plus the
+#number of its block, so the sizes in the histogram tell the blocks of the sampled fragments
+def writePairsBam(bamFile):
+    header={'HD':{'VN':'1.6','SO':'coordinate'},'SQ':[{'SN':'chr1','LN':NUM_BLOCKS*isa.SAMPLE_BLOCK}]}
+    step=isa.SAMPLE_BLOCK//PAIRS_PER_BLOCK
+    myBam=pysam.AlignmentFile(bamFile,'wb',header=header)
+    for blockIdx in range(NUM_BLOCKS):
+        for pairIdx in range(PAIRS_PER_BLOCK):
+            read=pysam.AlignedSegment()
+            read.query_name='r%d_%d'%(blockIdx,pairIdx)
+            read.flag=0x1|0x2|0x20|0x40
+            read.reference_id=0
+            read.reference_start=blockIdx*isa.SAMPLE_BLOCK+pairIdx*step
+            read.mapping_quality=60
+            read.cigarstring='50M'
+            read.query_sequence='A'*50
+            read.next_reference_id=0
+            read.next_reference_start=read.reference_start+100
+            read.template_length=200+blockIdx
+            myBam.write(read)
+    myBam.close()
+    pysam.index(bamFile)
+
+def test_sample_pairs_spread_over_blocks(tmp_path):
+    bamFile=str(tmp_path/'pairs.bam')
+    writePairsBam(bamFile)
+    myBam=pysam.AlignmentFile(bamFile,'rb')
+    blocksRead,numBlocks,sampledLen=isa.sampleRegion(myBam,'chr1',0,NUM_BLOCKS*isa.SAMPLE_BLOCK,samplePairs=1000)
+    myBam.close()
+    sampledLen.flush()
+    assert numBlocks==NUM_BLOCKS
+    assert sampledLen.count()==1000
+    #every block gives its share of the sample, not only the first blocks of the random order
+    assert blocksRead==NUM_BLOCKS
+    assert len(sampledLen.counts.nonzero()[0])==NUM_BLOCKS
@@ -0,0 +1,78 @@
+import io
+import os
+import sys
+
+import pysam
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import sam2Flat
+
+REF_SEQ='ACGTACGTAC'*10
+
+#a reference of one contig chr1 and a bam file with one read with its bases and one secondary alignment without SEQ (*)
+#at the same position; the read with bases has the mismatch G>T at position 3 and an insertion
+def writeTestFiles(tmp_path):
+    refGenome=str(tmp_path/'ref.fa')
+    OutFile=open(refGenome,'w')
+    OutFile.write('>chr1\n'+REF_SEQ+'\n')
+    OutFile.close()
+    pysam.faidx(refGenome)
+    bamFile=str(tmp_path/'reads.bam')
+    header={'HD':{'VN':'1.6','SO':'coordinate'},'SQ':[{'SN':'chr1','LN':len(REF_SEQ)}]}
+    myBam=pysam.AlignmentFile(bamFile,'wb',header=header)
+    for name,flag,sequence in [('withSeq',0,'ACTTAGACGTAC'),('noSeq',0x100,None)]:
+        read=pysam.AlignedSegment()
+        read.query_name=name
+        read.flag=flag
+        read.reference_id=0
+        read.reference_start=0
+        read.mapping_quality=60
+        read.cigarstring='5M2I5M'
+        read.query_sequence=sequence
+        read.set_tag('MD','2G7')
+        myBam.write(read)
+    myBam.close()
+    pysam.index(bamFile)
+    return bamFile,refGenome
+
+def test_aggregate_skips_reads_without_seq(tmp_path):
+    bamFile,refGenome=writeTestFiles(tmp_path)
+    myBam=pysam.AlignmentFile(bamFile,'rb')
+    refCache=sam2Flat.ReferenceCache(pysam.FastaFile(refGenome))
+    OutFile=io.StringIO()
+    sam2Flat.aggregateChunk(myBam,refCache,'chr1',0,len(REF_SEQ),OutFile,sam2Flat.PILEUP_WINDOW)
+    myBam.close()
+    rows=[line.split('\t') for line in OutFile.getvalue().splitlines()]
+    assert [int(row[1]) for row in rows]==list(range(1,11))
+    #only the read with bases is counted
+    assert all([row[3]=='1' for row in rows])
+    assert rows[2][2]=='G' and rows[2][7]=='1'
+
+def readsByName(bamFile):
+    myBam=pysam.AlignmentFile(bamFile,'rb')
+    reads=dict([(read.query_name,read) for read in myBam.fetch('chr1')])
+    myBam.close()
+    return reads
+
+def test_expand_read_without_seq(tmp_path):
+    bamFile,refGenome=writeTestFiles(tmp_path)
+    reads=readsByName(bamFile)
+    refCache=sam2Flat.ReferenceCache(pysam.FastaFile(refGenome))
+    rows,countH,countP=sam2Flat.expandRead(reads['noSeq'],refCache)
+    withSeqRows,countH,countP=sam2Flat.expandRead(reads['withSeq'],refCache)
+    #the same positions as the read with bases, with the base '-' and no variants
+    assert [row[:4] for row in rows]==[row[:4] for row in withSeqRows]
+    assert all([row[4]=='-' and not row[5] for row in rows])
+    variantRows,countH,countP=sam2Flat.expandReadVariants(reads['noSeq'],refCache)
+    assert [row[2] for row in variantRows]==['I','I']
+    assert [row[5] for row in sam2Flat.expandReadVariants(reads['withSeq'],refCache)[0]]==[True,False,False]
+
+def test_flat_file_with_read_without_seq(tmp_path):
+    bamFile,refGenome=writeTestFiles(tmp_path)
+    flatFileName=str(tmp_path/'reads_flat.txt')
+    sam2Flat.generateFlatFileFromBam(bamFile,flatFileName,refGenome,baseQual=True)
+    #as in the first version there is an empty line after the rows of every read
+    rows=[line.split('\t') for line in open(flatFileName).read().splitlines()[1:] if line!='']
+    assert len(rows)==24
+    assert [row[7] for row in rows if row[0]=='noSeq']==['-']*12
+    assert [row[9] for row in rows if row[0]=='noSeq']==['-']*12